@@ -0,0 +1,320 @@
+"""
+Load benchmark for the API routes, runs entirely on the local machine.
+
+Seed a database (SQLite file or a local Postgres) with a reproducible data set:
+
+    $ python bench/bench.py seed --db sqlite:////tmp/bench.db --users 10000 --files 100000
+
+Drive the routes and print the results as JSON:
+
+    $ python bench/bench.py run --db sqlite:////tmp/bench.db --concurrency 8 --requests 2000 > before.json
+
+By default the app is called in-process through the Flask test client, which
+measures the handlers and the database without a web server. Pass
+--url http://localhost:3000 to send real HTTP requests to a running gunicorn
+instead (seed the same database it uses). Cloudinary is always replaced by
+the local uploader.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+INSTRUMENTS = ['guitar', 'piano', 'drums', 'bass', 'violin', 'voice', 'saxophone', 'trumpet']
+LEVELS = ['beginner', 'intermediate', 'advanced']
+LANGUAGES = ['en', 'es', 'pt', 'fr']
+TYPES = ['pdf', 'video', 'audio', 'image']
+WORDS = ['scales', 'chords', 'rhythm', 'blues', 'jazz', 'rock', 'classical', 'theory',
+         'warmup', 'technique', 'improvisation', 'reading', 'ear', 'training', 'groove']
+PASSWORD = 'bench-password'
+BATCH_SIZE = 5000
+
+ROUTES = ['login', 'users', 'files', 'files_page', 'file', 'user', 'facets', 'match']
+
+
+def load_app(db_url, cache, limits=False):
+    os.environ['DB_CONNECTION_STRING'] = db_url
+    os.environ['UPLOADER'] = 'local'
+    if not cache:
+        os.environ['CACHE_BACKEND'] = 'none'
+    if not limits:
+        # one client hammering the routes is exactly what the limits refuse
+        os.environ['RATE_LIMIT_BACKEND'] = 'none'
+    import main
+    import models
+    return main.create_app(), models
+
+
+def email(n):
+    return 'bench%d@example.com' % n
+
+
+def _insert(models, table, rows):
+    models.db.session.execute(table.insert(), rows)
+
+
+def seed(args):
+    app, models = load_app(args.db, cache=False)
+    import catalog
+    import passwords
+    rng = random.Random(args.seed)
+    # every bench user has the same password, hash it once
+    password = passwords.hash_password(PASSWORD)
+    db = models.db
+    started = time.perf_counter()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        rows = []
+        for n in range(1, args.users + 1):
+            rows.append({
+                "id": n, "first_name": "First%d" % n, "last_name": "Last%d" % n,
+                "email": email(n), "password": password,
+                "account_type": "teacher" if n % 3 == 0 else "student",
+                "language": rng.choice(LANGUAGES), "instrument": rng.choice(INSTRUMENTS),
+                "level": rng.choice(LEVELS), "description": "bench user", "customer_id": "cus_%d" % n
+            })
+            if len(rows) == BATCH_SIZE:
+                _insert(models, models.User.__table__, rows)
+                rows = []
+        if rows:
+            _insert(models, models.User.__table__, rows)
+
+        teachers, students = [], []
+        for n in range(1, args.users + 1):
+            row = {"user_id": n, "instrument": rng.choice(INSTRUMENTS)}
+            (teachers if n % 3 == 0 else students).append(row)
+        for chunk in range(0, len(teachers), BATCH_SIZE):
+            _insert(models, models.Teacher.__table__, teachers[chunk:chunk + BATCH_SIZE])
+        for chunk in range(0, len(students), BATCH_SIZE):
+            _insert(models, models.Student.__table__, students[chunk:chunk + BATCH_SIZE])
+
+        rows = []
+        for n in range(1, args.files + 1):
+            rows.append({
+                "id": n, "instrument": rng.choice(INSTRUMENTS), "type_file": rng.choice(TYPES),
+                "level": rng.choice(LEVELS), "language": rng.choice(LANGUAGES),
+                "url": "https://example.com/files/%d" % n,
+                "title": ' '.join(rng.sample(WORDS, 3)).capitalize(),
+                "user_id": rng.randint(1, args.users) if args.users else None
+            })
+            if len(rows) == BATCH_SIZE:
+                _insert(models, models.Files.__table__, rows)
+                rows = []
+        if rows:
+            _insert(models, models.Files.__table__, rows)
+        # the rows went around the ORM, fill the facet counters and the change log
+        catalog.recount_facets(db.session)
+        catalog.record_file_changes(db.session, upserted=range(1, args.files + 1))
+        db.session.commit()
+    print(json.dumps({
+        "seeded": {"users": args.users, "files": args.files, "teachers": len(teachers), "students": len(students)},
+        "seconds": round(time.perf_counter() - started, 2)
+    }))
+
+
+class InProcessClient:
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, body=None, headers=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = dict(headers or {})
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req) as response:
+                payload = response.read()
+                return response.status, json.loads(payload) if payload else None
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, None
+
+
+def make_routes(counts, token, page_size):
+    auth = {'Authorization': 'Bearer ' + token}
+
+    def login(rng):
+        return 'POST', '/login', {"email": email(rng.randint(1, counts['users'])), "password": PASSWORD}, None
+
+    def users(rng):
+        return 'GET', '/users', None, None
+
+    def files(rng):
+        return 'GET', '/files', None, None
+
+    def files_page(rng):
+        return 'GET', '/files?limit=%d&instrument=%s' % (page_size, rng.choice(INSTRUMENTS)), None, None
+
+    def file(rng):
+        return 'GET', '/file/%d' % rng.randint(1, counts['files']), None, None
+
+    def user(rng):
+        return 'GET', '/user/%d' % rng.randint(1, counts['users']), None, auth
+
+    def facets(rng):
+        return 'GET', '/files/facets?instrument=%s' % rng.choice(INSTRUMENTS), None, None
+
+    def match(rng):
+        # seeded students are the users whose number isn't a multiple of 3
+        student = rng.randint(1, counts['users'])
+        student += 1 if student % 3 == 0 and student < counts['users'] else 0
+        return 'GET', '/teachers/match?student_id=%d' % student, None, auth
+
+    return {x.__name__: x for x in (login, users, files, files_page, file, user, facets, match)}
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def drive(client, route, requests, concurrency, seed_value):
+    latencies = []
+    errors = [0]
+    shed = [0]
+    lock = threading.Lock()
+
+    def worker(n):
+        rng = random.Random(seed_value * 1000003 + n)
+        method, path, body, headers = route(rng)
+        start = time.perf_counter()
+        try:
+            status, _ = client.request(method, path, body, headers)
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status in (429, 503):
+                shed[0] += 1
+            elif status is None or status >= 400:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(requests)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors[0],
+        "shed": shed[0],
+        "seconds": round(wall, 3),
+        "throughput_rps": round(requests / wall, 1) if wall else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    app, models = load_app(args.db, cache=args.cache, limits=args.limits)
+    with app.app_context():
+        counts = {
+            "users": models.User.query.count(),
+            "files": models.Files.query.count(),
+            "teachers": models.Teacher.query.count(),
+            "students": models.Student.query.count()
+        }
+    if not counts['users'] or not counts['files']:
+        sys.exit('the database is empty, run the seed command first')
+    client = HttpClient(args.url) if args.url else InProcessClient(app)
+
+    status, body = client.request('POST', '/login', {"email": email(1), "password": PASSWORD})
+    if status != 200:
+        sys.exit('could not log in as %s (status %s)' % (email(1), status))
+    routes = make_routes(counts, body['jwt'], args.page_size)
+
+    results = {}
+    for name in args.routes:
+        if args.warmup:
+            drive(client, routes[name], min(args.warmup, args.requests), args.concurrency, args.seed + 1)
+        results[name] = drive(client, routes[name], args.requests, args.concurrency, args.seed)
+        print('%-10s %s' % (name, json.dumps(results[name])), file=sys.stderr)
+
+    report = {
+        "revision": git_revision(),
+        "database": app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+        "mode": "http" if args.url else "in-process",
+        "rows": counts,
+        "concurrency": args.concurrency,
+        "cache": args.cache,
+        "limits": args.limits,
+        "routes": results
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.environ.get('BENCH_DB', 'sqlite:////tmp/jamfree-bench.db'),
+                        help='database url, also used by the app under test')
+    parser.add_argument('--seed', type=int, default=42, help='random seed, same seed same data and requests')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='recreate the tables and fill them')
+    seed_parser.add_argument('--users', type=int, default=10000)
+    seed_parser.add_argument('--files', type=int, default=10000)
+    seed_parser.set_defaults(func=seed)
+
+    run_parser = commands.add_parser('run', help='drive the routes and report latency and throughput')
+    run_parser.add_argument('--url', help='base url of a running server, default is in-process')
+    run_parser.add_argument('--routes', nargs='+', choices=ROUTES, default=ROUTES)
+    run_parser.add_argument('--requests', type=int, default=1000, help='requests per route')
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--warmup', type=int, default=50, help='requests per route before measuring')
+    run_parser.add_argument('--page-size', type=int, default=50, help='limit used by the files_page route')
+    run_parser.add_argument('--no-cache', dest='cache', action='store_false', help='disable the catalog cache')
+    run_parser.add_argument('--limits', action='store_true',
+                            help='keep the rate and concurrency limits on, refused requests are counted as shed')
+    run_parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    run_parser.set_defaults(func=run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,74 @@
+"""
+Boot time of the app: what a new worker (or a `flask` command) pays before
+its first response.
+
+Every run is a fresh interpreter that imports main, calls create_app() and
+sends a first request to the API and then to the admin, timing each step.
+Prints the medians over --runs as JSON:
+
+    $ python bench/bench.py seed --db sqlite:////tmp/bench.db --users 1000 --files 1000
+    $ python bench/boot.py --db sqlite:////tmp/bench.db --runs 10
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from bench import ROOT, git_revision
+
+PROBE = r'''
+import sys, time, json, resource
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.create_app()
+created = time.perf_counter()
+client = app.test_client()
+status = client.get(sys.argv[1]).status_code
+first_request = time.perf_counter()
+modules = len(sys.modules)
+admin_status = client.get('/admin/').status_code
+first_admin = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (first_request - created) * 1000,
+    "first_admin_ms": (first_admin - first_request) * 1000,
+    "ready_ms": (first_request - started) * 1000,
+    "modules": modules,
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "status": [status, admin_status]
+}))
+'''
+
+
+def probe(env, path):
+    output = subprocess.check_output([sys.executable, '-c', PROBE, path], cwd=os.path.join(ROOT, 'src'), env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.environ.get('BENCH_DB', 'sqlite:////tmp/jamfree-bench.db'))
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/files?limit=1', help='first API request')
+    args = parser.parse_args()
+
+    env = dict(os.environ, DB_CONNECTION_STRING=args.db, UPLOADER='local', CACHE_BACKEND='none')
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    runs = [probe(env, args.path) for _ in range(args.runs)]
+    if any(x["status"] != [200, 200] for x in runs):
+        raise SystemExit('unexpected status %s, is the database seeded?' % runs[0]["status"])
+
+    print(json.dumps({
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "median": {key: round(statistics.median(x[key] for x in runs), 2)
+                   for key in runs[0] if key != "status"}
+    }, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main_cli()
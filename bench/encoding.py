@@ -0,0 +1,75 @@
+"""
+Encode time and bytes on the wire for the catalog payloads.
+
+Uses a database filled by `bench.py seed` and compares, for the full /files
+and /users bodies, every JSON provider available (std, orjson) and every
+content encoding (identity, gzip, brotli). Prints the results as JSON:
+
+    $ python bench/bench.py seed --db sqlite:////tmp/bench.db --users 10000 --files 100000
+    $ python bench/encoding.py --db sqlite:////tmp/bench.db
+"""
+import gzip
+import json
+import time
+import argparse
+from bench import load_app, git_revision
+
+import encoding
+from flask.json.provider import DefaultJSONProvider
+
+
+def timed(func, repeat):
+    # best of repeat runs, in milliseconds, and the last result
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 3), result
+
+
+def measure(payload, providers, repeat):
+    results = {}
+    for name, provider in providers.items():
+        encode_ms, body = timed(lambda: provider.dumps(payload).encode('utf-8'), repeat)
+        entry = {"encode_ms": encode_ms, "bytes": {"identity": len(body)}, "compress_ms": {}}
+        compress_ms, data = timed(lambda: gzip.compress(body, encoding.GZIP_LEVEL), repeat)
+        entry["bytes"]["gzip"] = len(data)
+        entry["compress_ms"]["gzip"] = compress_ms
+        if encoding.brotli is not None:
+            compress_ms, data = timed(lambda: encoding.brotli.compress(body, quality=encoding.BROTLI_QUALITY), repeat)
+            entry["bytes"]["br"] = len(data)
+            entry["compress_ms"]["br"] = compress_ms
+        results[name] = entry
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:////tmp/jamfree-bench.db')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the best one is reported')
+    args = parser.parse_args()
+
+    app, models = load_app(args.db, cache=False)
+    providers = {"std": DefaultJSONProvider(app)}
+    if encoding.orjson is not None:
+        providers["orjson"] = encoding.OrjsonProvider(app)
+
+    with app.app_context():
+        # the same bodies GET /files and GET /users send
+        files = [list(map(lambda x: x.serialize(), models.Files.query.all())), 200]
+        users = [list(map(lambda x: x.serialize(), models.User.query.all())), 200]
+        report = {
+            "revision": git_revision(),
+            "rows": {"files": len(files[0]), "users": len(users[0])},
+            "endpoints": {
+                "/files": measure(files, providers, args.repeat),
+                "/users": measure(users, providers, args.repeat)
+            }
+        }
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,72 @@
+"""
+Login throughput of one worker for password hashing settings.
+
+For each --rounds value the bench users' password is stored hashed with that
+many rounds, then POST /login is driven in-process (one process, like one
+gunicorn worker) by --concurrency client threads while PASSWORD_WORKERS
+threads do the hashing. Prints the results as JSON:
+
+    $ python bench/bench.py seed --db sqlite:////tmp/bench.db --users 1000 --files 0
+    $ python bench/login.py --db sqlite:////tmp/bench.db --rounds 100000 260000 600000
+"""
+import os
+import json
+import time
+import argparse
+from bench import load_app, git_revision, drive, make_routes, InProcessClient, PASSWORD
+
+
+def hash_ms(passwords, rounds, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        passwords.hash_password(PASSWORD, rounds)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 2)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.environ.get('BENCH_DB', 'sqlite:////tmp/jamfree-bench.db'))
+    parser.add_argument('--rounds', type=int, nargs='+', default=[260000])
+    parser.add_argument('--workers', type=int, help='PASSWORD_WORKERS, default from the environment')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100, help='logins per rounds value')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.workers:
+        os.environ['PASSWORD_WORKERS'] = str(args.workers)
+    app, models = load_app(args.db, cache=False)
+    import passwords
+
+    with app.app_context():
+        users = models.User.query.count()
+    if not users:
+        raise SystemExit('the database is empty, run the seed command first')
+    client = InProcessClient(app)
+    route = make_routes({"users": users}, '', 0)['login']
+
+    results = {}
+    for rounds in args.rounds:
+        passwords.PASSWORD_HASH_ROUNDS = rounds
+        with app.app_context():
+            # same hash for everyone, and current settings so no login rehashes
+            models.db.session.execute(models.User.__table__.update().values(password=passwords.hash_password(PASSWORD)))
+            models.db.session.commit()
+        result = drive(client, route, args.requests, args.concurrency, args.seed)
+        result["hash_ms"] = hash_ms(passwords, rounds)
+        results[str(rounds)] = result
+
+    print(json.dumps({
+        "revision": git_revision(),
+        "cpus": os.cpu_count(),
+        "password_workers": passwords.password_hasher.workers,
+        "concurrency": args.concurrency,
+        "rounds": results
+    }, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,44 @@
+"""
+gunicorn settings, used by the Procfile:
+
+    $ gunicorn --config gunicorn.conf.py --chdir ./src/ wsgi
+
+WEB_CONCURRENCY       worker processes (default 2)
+GUNICORN_THREADS      threads per worker, more than 1 uses the gthread worker
+GUNICORN_PRELOAD      1 (default) builds the app once in the master before
+                      forking, so the workers start at once and share its
+                      memory pages instead of each importing everything again
+GUNICORN_TIMEOUT      seconds before a silent worker is restarted
+"""
+import gc
+import os
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', 3000)
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+accesslog = '-'
+
+
+def when_ready(server):
+    if preload_app:
+        # move everything the app allocated at boot out of the collector's
+        # reach: collections in the workers then don't write to (and copy)
+        # the pages they share with the master
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # a connection the master opened while preloading must not be
+        # shared by the workers
+        from wsgi import application
+        from database import dispose_engines
+        dispose_engines(application)
+
+
+def child_exit(server, worker):
+    from metrics import child_exit
+    child_exit(server, worker)
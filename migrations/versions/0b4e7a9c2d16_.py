@@ -0,0 +1,23 @@
+"""files user_id index
+
+Revision ID: 0b4e7a9c2d16
+Revises: f6b8d0c3e912
+Create Date: 2026-10-18 20:05:13.402719
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0b4e7a9c2d16'
+down_revision = 'f6b8d0c3e912'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_files_user_id'), 'files', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_files_user_id'), table_name='files')
@@ -0,0 +1,40 @@
+"""media orphan outbox
+
+Revision ID: 3c7e1d9a4b58
+Revises: 0b4e7a9c2d16
+Create Date: 2026-10-18 21:12:40.318562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7e1d9a4b58'
+down_revision = '0b4e7a9c2d16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media_orphan',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('url', sa.String(length=200), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('error', sa.String(length=200), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_media_orphan_next_attempt_at'), 'media_orphan', ['next_attempt_at'], unique=False)
+    op.create_index(op.f('ix_files_url'), 'files', ['url'], unique=False)
+    op.create_index(op.f('ix_media_asset_url'), 'media_asset', ['url'], unique=False)
+    op.create_index(op.f('ix_user_profile_picture'), 'user', ['profile_picture'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_profile_picture'), table_name='user')
+    op.drop_index(op.f('ix_media_asset_url'), table_name='media_asset')
+    op.drop_index(op.f('ix_files_url'), table_name='files')
+    op.drop_index(op.f('ix_media_orphan_next_attempt_at'), table_name='media_orphan')
+    op.drop_table('media_orphan')
@@ -0,0 +1,29 @@
+"""files filter indexes
+
+Revision ID: 3c7e1f2a9b10
+Revises: 995d7400adfa
+Create Date: 2026-10-18 09:12:31.402118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7e1f2a9b10'
+down_revision = '995d7400adfa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_files_instrument_id', 'files', ['instrument', 'id'], unique=False)
+    op.create_index('ix_files_level_id', 'files', ['level', 'id'], unique=False)
+    op.create_index('ix_files_language_id', 'files', ['language', 'id'], unique=False)
+    op.create_index('ix_files_type_file_id', 'files', ['type_file', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_files_type_file_id', table_name='files')
+    op.drop_index('ix_files_language_id', table_name='files')
+    op.drop_index('ix_files_level_id', table_name='files')
+    op.drop_index('ix_files_instrument_id', table_name='files')
@@ -0,0 +1,34 @@
+"""upload jobs
+
+Revision ID: 5e9a3d1c7b22
+Revises: b41f0c7d2e58
+Create Date: 2026-10-18 13:48:09.551376
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9a3d1c7b22'
+down_revision = 'b41f0c7d2e58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upload_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('result_url', sa.String(length=200), nullable=True),
+    sa.Column('error', sa.String(length=200), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('upload_job')
@@ -0,0 +1,29 @@
+"""file change lock
+
+Revision ID: 6a1d4f8c3e27
+Revises: 3c7e1d9a4b58
+Create Date: 2026-10-18 23:05:12.604931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a1d4f8c3e27'
+down_revision = '3c7e1d9a4b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_change_lock',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO file_change_lock (id) VALUES (1)")
+
+
+def downgrade():
+    op.drop_table('file_change_lock')
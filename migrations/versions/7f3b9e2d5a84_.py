@@ -0,0 +1,37 @@
+"""file facet counters
+
+Revision ID: 7f3b9e2d5a84
+Revises: e2a7c4b9f615
+Create Date: 2026-10-18 17:04:51.220394
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3b9e2d5a84'
+down_revision = 'e2a7c4b9f615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_facet',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('instrument', sa.String(length=120), nullable=False),
+    sa.Column('level', sa.String(length=120), nullable=False),
+    sa.Column('language', sa.String(length=120), nullable=False),
+    sa.Column('type_file', sa.String(length=120), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('instrument', 'level', 'language', 'type_file')
+    )
+    # counts of the files already there, maintained by the app from now on
+    op.execute("INSERT INTO file_facet (instrument, level, language, type_file, count) "
+               "SELECT instrument, level, language, type_file, COUNT(*) FROM files "
+               "GROUP BY instrument, level, language, type_file")
+
+
+def downgrade():
+    op.drop_table('file_facet')
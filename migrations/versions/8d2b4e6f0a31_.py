@@ -0,0 +1,61 @@
+"""files full text index
+
+Revision ID: 8d2b4e6f0a31
+Revises: 3c7e1f2a9b10
+Create Date: 2026-10-18 10:03:57.118204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2b4e6f0a31'
+down_revision = '3c7e1f2a9b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("""CREATE VIRTUAL TABLE files_fts USING fts5(
+            title, instrument, level, language, type_file,
+            content='files', content_rowid='id'
+        )""")
+        op.execute("""CREATE TRIGGER files_fts_ai AFTER INSERT ON files BEGIN
+            INSERT INTO files_fts(rowid, title, instrument, level, language, type_file)
+            VALUES (new.id, new.title, new.instrument, new.level, new.language, new.type_file);
+        END""")
+        op.execute("""CREATE TRIGGER files_fts_ad AFTER DELETE ON files BEGIN
+            INSERT INTO files_fts(files_fts, rowid, title, instrument, level, language, type_file)
+            VALUES ('delete', old.id, old.title, old.instrument, old.level, old.language, old.type_file);
+        END""")
+        op.execute("""CREATE TRIGGER files_fts_au AFTER UPDATE ON files BEGIN
+            INSERT INTO files_fts(files_fts, rowid, title, instrument, level, language, type_file)
+            VALUES ('delete', old.id, old.title, old.instrument, old.level, old.language, old.type_file);
+            INSERT INTO files_fts(rowid, title, instrument, level, language, type_file)
+            VALUES (new.id, new.title, new.instrument, new.level, new.language, new.type_file);
+        END""")
+        # index the rows that already exist
+        op.execute("INSERT INTO files_fts(files_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        # a generated column is computed for the existing rows by the ALTER itself
+        op.execute("""ALTER TABLE files ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('simple',
+                coalesce(instrument, '') || ' ' || coalesce(level, '') || ' ' ||
+                coalesce(language, '') || ' ' || coalesce(type_file, '')), 'B')
+        ) STORED""")
+        op.execute("CREATE INDEX ix_files_search_vector ON files USING GIN (search_vector)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS files_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS files_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS files_fts_ai")
+        op.execute("DROP TABLE IF EXISTS files_fts")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_files_search_vector")
+        op.execute("ALTER TABLE files DROP COLUMN IF EXISTS search_vector")
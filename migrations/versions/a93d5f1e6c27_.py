@@ -0,0 +1,25 @@
+"""teacher and student user_id indexes
+
+Revision ID: a93d5f1e6c27
+Revises: 7f3b9e2d5a84
+Create Date: 2026-10-18 17:48:12.608152
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93d5f1e6c27'
+down_revision = '7f3b9e2d5a84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_student_user_id'), 'student', ['user_id'], unique=False)
+    op.create_index(op.f('ix_teacher_user_id'), 'teacher', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_teacher_user_id'), table_name='teacher')
+    op.drop_index(op.f('ix_student_user_id'), table_name='student')
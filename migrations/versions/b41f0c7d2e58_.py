@@ -0,0 +1,30 @@
+"""updated_at on user and files
+
+Revision ID: b41f0c7d2e58
+Revises: 8d2b4e6f0a31
+Create Date: 2026-10-18 11:26:40.730512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b41f0c7d2e58'
+down_revision = '8d2b4e6f0a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.add_column('files', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    # existing rows start with the migration time as their last change
+    for table_name in ('user', 'files'):
+        table = sa.table(table_name, sa.column('updated_at', sa.DateTime()))
+        op.execute(table.update().values(updated_at=sa.func.now()))
+
+
+def downgrade():
+    op.drop_column('files', 'updated_at')
+    op.drop_column('user', 'updated_at')
@@ -0,0 +1,36 @@
+"""media assets and profile thumbnail
+
+Revision ID: c8f16a4e9d03
+Revises: 5e9a3d1c7b22
+Create Date: 2026-10-18 15:02:44.281960
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f16a4e9d03'
+down_revision = '5e9a3d1c7b22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media_asset',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('url', sa.String(length=200), nullable=False),
+    sa.Column('public_id', sa.String(length=200), nullable=True),
+    sa.Column('thumbnail_url', sa.String(length=200), nullable=True),
+    sa.Column('thumbnail_public_id', sa.String(length=200), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('sha256')
+    )
+    op.add_column('user', sa.Column('profile_thumbnail', sa.String(length=200), nullable=True))
+
+
+def downgrade():
+    op.drop_column('user', 'profile_thumbnail')
+    op.drop_table('media_asset')
@@ -0,0 +1,24 @@
+"""user version
+
+Revision ID: d5c2a8e71f40
+Revises: a93d5f1e6c27
+Create Date: 2026-10-18 18:32:40.117284
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5c2a8e71f40'
+down_revision = 'a93d5f1e6c27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('user', 'version')
@@ -0,0 +1,35 @@
+"""file change log
+
+Revision ID: e2a7c4b9f615
+Revises: c8f16a4e9d03
+Create Date: 2026-10-18 16:21:09.513027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7c4b9f615'
+down_revision = 'c8f16a4e9d03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_change',
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=10), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('version'),
+    sqlite_autoincrement=True
+    )
+    op.create_index(op.f('ix_file_change_file_id'), 'file_change', ['file_id'], unique=False)
+    # the existing files are the first changes, so since=0 returns the whole catalog
+    op.execute("INSERT INTO file_change (file_id, op, changed_at) SELECT id, 'upsert', CURRENT_TIMESTAMP FROM files ORDER BY id")
+
+
+def downgrade():
+    op.drop_index(op.f('ix_file_change_file_id'), table_name='file_change')
+    op.drop_table('file_change')
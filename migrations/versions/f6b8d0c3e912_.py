@@ -0,0 +1,34 @@
+"""wider password column for hashes
+
+Revision ID: f6b8d0c3e912
+Revises: d5c2a8e71f40
+Create Date: 2026-10-18 19:10:27.845301
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b8d0c3e912'
+down_revision = 'd5c2a8e71f40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing plaintext passwords are hashed by the app at the next login
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=80),
+               type_=sa.String(length=255),
+               existing_nullable=False)
+
+
+def downgrade():
+    # only possible while no hash is stored, they are longer than 80 characters
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=80),
+               existing_nullable=False)
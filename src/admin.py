@@ -1,18 +1,68 @@
+"""
+The admin at /admin.
+
+flask_admin is slow to import and only staff ever open it, so it is not part
+of the API app: setup_admin() puts a small WSGI dispatcher in front of the app
+that sends /admin requests to a separate Flask app, built (and flask_admin
+imported) on the first of them. The views live in admin_views.py. It shares
+the API app's response cache, so admin commits evict the files they change.
+"""
 import os
-from flask_admin import Admin
-from models import db, User, Teacher, Student
-from flask_admin.contrib.sqla import ModelView
+import threading
+from flask import Flask
+from database import setup_database
+from models import db
 
-def setup_admin(app):
-    app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
-    app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
-    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
+ADMIN_URL = '/admin'
+
+
+class LazyAdmin:
+
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.admin_app = None
+        self.lock = threading.Lock()
+
+    def get_admin_app(self):
+        with self.lock:
+            if self.admin_app is None:
+                self.admin_app = create_admin_app(self.app)
+            return self.admin_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == ADMIN_URL or path.startswith(ADMIN_URL + '/'):
+            return self.get_admin_app().wsgi_app(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+
+def create_admin_app(parent):
+    from flask_admin import Admin
+    from admin_views import UserView, ProfileView, FilesView
+    from models import User, Teacher, Student, Files
+
+    app = Flask(__name__)
+    app.config.update(parent.config)
+    setup_database(app)
+    db.init_app(app)
+    # catalog.py evicts through the cache of the app in context
+    if 'cache' in parent.extensions:
+        app.extensions['cache'] = parent.extensions['cache']
+    admin = Admin(app, name='4Geeks Admin', url=ADMIN_URL, template_mode='bootstrap3')
 
-    
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Teacher, db.session))
-    admin.add_view(ModelView(Student, db.session))
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(ProfileView(Teacher, db.session))
+    admin.add_view(ProfileView(Student, db.session))
+    admin.add_view(FilesView(Files, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
+    return app
+
+
+def setup_admin(app):
+    app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
+    app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
+    app.wsgi_app = LazyAdmin(app, app.wsgi_app)
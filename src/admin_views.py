@@ -0,0 +1,117 @@
+"""
+Model views of the admin, imported by admin.py when the admin is first opened.
+"""
+from flask import request
+from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.filters import FilterEqual
+from wtforms import PasswordField
+from sqlalchemy import or_, text
+from models import db, User, Files
+from database import read_from_replica
+from passwords import password_hasher
+
+
+class ScalableModelView(ModelView):
+    # list pages that stay cheap on big tables:
+    # - no count(*): the total shown is the database's estimate, and with a
+    #   search or filter only prev/next links
+    # - a page is picked by scanning ids only, then those rows are fetched;
+    #   still an OFFSET, so deep pages cost more, the pager has no last id to
+    #   continue from
+    # - search, filters and sorting only on indexed columns (set per view)
+    # - reads go to the replica when there is one
+    simple_list_pager = True
+    column_default_sort = ('id', True)
+    page_size = 50
+    can_set_page_size = True
+
+    def _handle_view(self, name, **kwargs):
+        if request.method == 'GET':
+            read_from_replica()
+        return super()._handle_view(name, **kwargs)
+
+    def estimated_count(self):
+        table = self.model.__table__.name
+        connection = self.session.connection()
+        dialect = connection.dialect.name
+        if dialect == 'postgresql':
+            # planner statistics, -1 until the table has been analyzed
+            count = connection.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+                                       {"table": '"%s"' % table}).scalar()
+            if count is not None and count >= 0:
+                return count
+        elif dialect == 'mysql':
+            count = connection.execute(text("SELECT table_rows FROM information_schema.tables "
+                                            "WHERE table_schema = DATABASE() AND table_name = :table"),
+                                       {"table": table}).scalar()
+            if count is not None:
+                return count
+        # an upper bound read from the end of the primary key index
+        return self.session.query(db.func.max(self.model.id)).scalar() or 0
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        count, query = super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        if count is None and not search and not filters:
+            count = self.estimated_count()
+        return count, query
+
+    def _apply_pagination(self, query, page, page_size):
+        if page_size is None:
+            page_size = self.page_size
+        if not page or not page_size:
+            return super()._apply_pagination(query, page, page_size)
+        # skip the rows before the page on the (index only) id scan, then join
+        # back for the full rows of just this page. The skipped ids are still
+        # read, sort or filter to reach old rows instead of paging far
+        ids = query.with_entities(self.model.id).limit(page_size).offset(page * page_size).subquery()
+        return query.join(ids, ids.c.id == self.model.id).limit(page_size)
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # exact matches on the searchable (unique, indexed) columns instead of ILIKE '%term%'
+        search = search.strip()
+        clauses = [getattr(self.model, x) == search for x in self.column_searchable_list]
+        if search.isdigit():
+            clauses.append(self.model.id == int(search))
+        query = query.filter(or_(*clauses))
+        if count_query is not None:
+            count_query = count_query.filter(or_(*clauses))
+        return query, count_query, joins, count_joins
+
+
+def equal_filters(model, *columns):
+    # only =, the default string filters include LIKE '%...%' that no index helps
+    return [FilterEqual(getattr(model, x), x.replace('_', ' ').title()) for x in columns]
+
+
+class UserView(ScalableModelView):
+    column_exclude_list = ['password']
+    column_searchable_list = ['email', 'username']
+    column_sortable_list = ['id', 'email']
+    column_filters = ['id'] + equal_filters(User, 'email')
+    # related rows are edited from their own views, a select here would load them all
+    form_excluded_columns = ['password', 'files', 'teacher', 'student', 'version', 'updated_at']
+    form_extra_fields = {'new_password': PasswordField('New password')}
+
+    def search_placeholder(self):
+        return 'Exact email, username or id'
+
+    def on_model_change(self, form, model, is_created):
+        if form.new_password.data:
+            model.password = password_hasher.hash(form.new_password.data)
+        elif is_created:
+            raise ValueError('A new user needs a password')
+
+
+class ProfileView(ScalableModelView):
+    # Teacher and Student
+    column_sortable_list = ['id', 'user_id']
+    column_filters = ['id', 'user_id']
+    form_ajax_refs = {'user': {'fields': ['email'], 'page_size': 10}}
+
+
+class FilesView(ScalableModelView):
+    column_list = ['id', 'title', 'instrument', 'level', 'language', 'type_file', 'url', 'user_id']
+    column_sortable_list = ['id', 'instrument', 'level', 'language', 'type_file']
+    column_filters = ['id', 'user_id'] + equal_filters(Files, 'instrument', 'level', 'language', 'type_file')
+    form_excluded_columns = ['updated_at']
+    form_ajax_refs = {'user': {'fields': ['email'], 'page_size': 10}}
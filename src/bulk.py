@@ -0,0 +1,212 @@
+"""
+Bulk create, update and delete for Files.
+
+Every item is validated on its own and gets its own entry in the results;
+the valid ones are written together in one transaction with batched
+statements (executemany UPDATE, DELETE ... WHERE id IN, and a multi-row
+INSERT on Postgres and SQLite; MySQL inserts row by row to learn the ids).
+"""
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import text
+from utils import APIException
+from models import db, User, Files, FileFacet
+from catalog import record_file_changes, update_facets, facet_key
+from media import record_orphans
+
+BULK_MAX_ITEMS = 10000
+BATCH_SIZE = 500
+MAX_LENGTH = 120
+
+
+def _chunks(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _check_fields(record, errors):
+    for field, value in record.items():
+        if field == 'id':
+            continue
+        if field not in Files.FIELDS:
+            errors.append("unknown field '%s'" % field)
+        elif field == 'userId':
+            if value is not None and not isinstance(value, int):
+                errors.append("'userId' must be an integer")
+        elif not isinstance(value, str) or not value:
+            errors.append("'%s' must be a non empty string" % field)
+        elif len(value) > MAX_LENGTH:
+            errors.append("'%s' is longer than %d characters" % (field, MAX_LENGTH))
+
+
+def _check_users(records, results):
+    user_ids = set(x['userId'] for x in records.values() if x.get('userId') is not None)
+    if not user_ids:
+        return
+    found = set(x.id for x in User.query.with_entities(User.id).filter(User.id.in_(user_ids)))
+    for index, record in list(records.items()):
+        if record.get('userId') is not None and record['userId'] not in found:
+            results[index] = {"index": index, "ok": False, "errors": ["user %d does not exist" % record['userId']]}
+            del records[index]
+
+
+def _parse(records, validate):
+    # returns {index: record} of the valid items and the results list with
+    # the errors of the invalid ones already filled in
+    if len(records) == 0:
+        raise APIException("You need to specify at least one item", 400)
+    if len(records) > BULK_MAX_ITEMS:
+        raise APIException("You can send at most %d items at a time" % BULK_MAX_ITEMS, 400)
+    results = [None] * len(records)
+    valid = {}
+    for index, record in enumerate(records):
+        if isinstance(record, APIException):
+            errors = [record.message]
+        elif not isinstance(record, dict):
+            errors = ["item must be a json object"]
+        else:
+            errors = validate(record)
+        if errors:
+            results[index] = {"index": index, "ok": False, "errors": errors}
+        else:
+            valid[index] = record
+    return valid, results
+
+
+def _summary(results):
+    applied = len([x for x in results if x["ok"]])
+    return {"applied": applied, "failed": len(results) - applied, "results": results}
+
+
+def _validate_create(record):
+    errors = []
+    for field in Files.REQUIRED_FIELDS:
+        if field not in record:
+            errors.append("You need to specify %s" % field)
+    if 'id' in record:
+        errors.append("'id' is assigned by the server")
+    _check_fields(record, errors)
+    return errors
+
+
+def _validate_update(record):
+    errors = []
+    if not isinstance(record.get('id'), int):
+        errors.append("You need to specify the file id")
+    if len(record) < 2:
+        errors.append("You need to specify at least one field to change")
+    _check_fields(record, errors)
+    return errors
+
+
+def _row(record):
+    return {Files.FIELDS[field]: value for field, value in record.items() if field in Files.FIELDS}
+
+
+def create_files(records):
+    valid, results = _parse(records, _validate_create)
+    _check_users(valid, results)
+    now = datetime.utcnow()
+    indexes = list(valid)
+    table = Files.__table__
+    dialect = db.session.connection().dialect.name
+    for chunk in _chunks(indexes):
+        # every row needs the same keys for a multi-row VALUES
+        rows = [dict(((column, valid[index].get(field)) for field, column in Files.FIELDS.items()), updated_at=now) for index in chunk]
+        if dialect == 'postgresql':
+            # take the ids from the sequence first, RETURNING doesn't promise VALUES order
+            ids = [x[0] for x in db.session.execute(
+                text("SELECT nextval(pg_get_serial_sequence('files', 'id')) FROM generate_series(1, :count)"),
+                {"count": len(rows)}
+            )]
+            for row, file_id in zip(rows, ids):
+                row['id'] = file_id
+            db.session.execute(table.insert().values(rows))
+        elif dialect == 'sqlite':
+            # one writer at a time, so the rows get consecutive ids up to lastrowid
+            last = db.session.execute(table.insert().values(rows)).lastrowid
+            ids = list(range(last - len(rows) + 1, last + 1))
+        else:
+            # MySQL may interleave the ids of a multi-row INSERT with other
+            # inserts (innodb_autoinc_lock_mode=2), one INSERT per row instead
+            db.session.bulk_insert_mappings(Files, rows, return_defaults=True)
+            ids = [x['id'] for x in rows]
+        for index, file_id in zip(chunk, ids):
+            results[index] = {"index": index, "ok": True, "id": file_id}
+        record_file_changes(db.session, upserted=ids)
+        update_facets(db.session, Counter(facet_key(x) for x in rows))
+    db.session.commit()
+    return _summary(results), [x["id"] for x in results if x["ok"]]
+
+
+def update_files(records):
+    valid, results = _parse(records, _validate_update)
+    ids = set()
+    for index, record in list(valid.items()):
+        # a second update of the same file would count it twice in the facets
+        if record['id'] in ids:
+            results[index] = {"index": index, "ok": False, "errors": ["file %d is already updated by an earlier item" % record['id']]}
+            del valid[index]
+        ids.add(record['id'])
+    found = set()
+    for chunk in _chunks(list(ids)):
+        found.update(x.id for x in Files.query.with_entities(Files.id).filter(Files.id.in_(chunk)))
+    for index, record in list(valid.items()):
+        if record['id'] not in found:
+            results[index] = {"index": index, "ok": False, "errors": ["File not found"]}
+            del valid[index]
+    _check_users(valid, results)
+    now = datetime.utcnow()
+    mappings = [dict(_row(record), id=record['id'], updated_at=now) for record in valid.values()]
+    facet_columns = [getattr(Files, x) for x in FileFacet.COLUMNS]
+    for chunk in _chunks(mappings):
+        # the facets the files are counted under before the update, locked so a
+        # concurrent writer cannot move them before ours lands (in id order, no deadlocks)
+        before = {x.id: x for x in Files.query.with_entities(Files.id, Files.url, *facet_columns)
+                  .filter(Files.id.in_([x['id'] for x in chunk])).order_by(Files.id).with_for_update()}
+        deltas = Counter()
+        replaced = []
+        for mapping in chunk:
+            previous = before[mapping['id']]
+            deltas[facet_key(previous)] -= 1
+            deltas[tuple(mapping.get(x, getattr(previous, x)) for x in FileFacet.COLUMNS)] += 1
+            if mapping.get('url', previous.url) != previous.url:
+                replaced.append(previous.url)
+        # grouped by the set of changed columns and sent as executemany UPDATEs
+        db.session.bulk_update_mappings(Files, chunk)
+        record_file_changes(db.session, upserted=[x['id'] for x in chunk])
+        update_facets(db.session, deltas)
+        record_orphans(db.session, replaced)
+    db.session.commit()
+    for index, record in valid.items():
+        results[index] = {"index": index, "ok": True, "id": record['id']}
+    return _summary(results), [x["id"] for x in results if x["ok"]]
+
+
+def delete_files(records):
+    # items can be plain ids or {"id": ...} objects
+    def validate(record):
+        return [] if isinstance(record.get('id'), int) else ["You need to specify the file id"]
+    records = [{"id": x} if isinstance(x, int) else x for x in records]
+    valid, results = _parse(records, validate)
+    ids = set(x['id'] for x in valid.values())
+    found = set()
+    deltas = Counter()
+    urls = []
+    facet_columns = [getattr(Files, x) for x in FileFacet.COLUMNS]
+    for chunk in _chunks(list(ids)):
+        for row in Files.query.with_entities(Files.id, Files.url, *facet_columns).filter(Files.id.in_(chunk)).order_by(Files.id).with_for_update():
+            found.add(row.id)
+            deltas[facet_key(row)] -= 1
+            urls.append(row.url)
+        Files.query.filter(Files.id.in_(chunk)).delete(synchronize_session=False)
+    record_file_changes(db.session, deleted=found)
+    update_facets(db.session, deltas)
+    record_orphans(db.session, urls)
+    db.session.commit()
+    for index, record in valid.items():
+        if record['id'] in found:
+            results[index] = {"index": index, "ok": True, "id": record['id']}
+        else:
+            results[index] = {"index": index, "ok": False, "errors": ["File not found"]}
+    return _summary(results), sorted(found)
@@ -0,0 +1,204 @@
+"""
+Read-through cache for the file catalog GET routes.
+
+Responses are stored already encoded, so a hit skips the serialization and
+all but one indexed query. Every entry carries the change log version it was
+built at (catalog.py: latest_version() for the lists, file_version() for a
+single file) and is only used while that is still the current version, so a
+write by any process (another worker, the admin, `flask data import`) makes
+the entries it affects miss at once, and a response built from a read before
+a commit can't be stored over a newer one for good. Commits also delete the
+file:<id> entries of the files they wrote, to free the space early.
+Entries keep the ETag/Last-Modified they were built with, so a conditional
+request that hits the cache is answered with a 304 without building anything.
+
+Backends:
+    local  in-process LRU with TTL (default), one per gunicorn worker
+    redis  shared by every worker, needs the redis package and CACHE_URL
+    none   disables caching
+"""
+import os
+import time
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from flask import current_app, json
+from werkzeug.local import LocalProxy
+from utils import not_modified, set_validators
+
+
+class LocalCache:
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisCache:
+    # any client with the redis-py interface works, e.g. fakeredis in local runs
+
+    def __init__(self, client, ttl=300, prefix='jamfree:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def __len__(self):
+        # only our keys, the database may be shared; SCAN doesn't block redis like KEYS
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*', count=1000))
+
+
+class ResponseCache:
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _get(self, key):
+        if self.backend is None:
+            return None
+        try:
+            return self.backend.get(key)
+        except Exception:
+            # a broken cache must not take the catalog down with it
+            self.errors += 1
+            return None
+
+    def _set(self, key, value):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception:
+            self.errors += 1
+
+    def json_response(self, key, build, validators=None, version=None):
+        # validators() returns (etag, last_modified) and runs before build(),
+        # so a client that is up to date never pays for the serialization.
+        # version is read before anything the response is built from; an
+        # entry stored at another version is rebuilt and replaced.
+        # With key None the response is built every time but still conditional
+        entry = self._get(key) if key is not None else None
+        if entry is not None:
+            entry_version, etag, last_modified, body = self._unpack(entry)
+            if entry_version != str(version):
+                entry = None
+        if entry is not None:
+            self.hits += 1
+            if etag is not None:
+                response = not_modified(etag, last_modified)
+                if response is not None:
+                    return response
+        else:
+            if key is not None:
+                self.misses += 1
+            etag, last_modified = validators() if validators is not None else (None, None)
+            if etag is not None:
+                response = not_modified(etag, last_modified)
+                if response is not None:
+                    return response
+            body = json.dumps(build())
+            if key is not None:
+                self._set(key, self._pack(version, etag, last_modified, body))
+        response = current_app.response_class(body + '\n', mimetype='application/json')
+        if etag is not None:
+            set_validators(response, etag, last_modified)
+        return response
+
+    def _pack(self, version, etag, last_modified, body):
+        timestamp = last_modified.isoformat() if last_modified is not None else ''
+        return '%s\t%s\t%s\n%s' % (version, etag or '', timestamp, body)
+
+    def _unpack(self, entry):
+        header, body = entry.split('\n', 1)
+        version, etag, timestamp = header.split('\t')
+        last_modified = datetime.fromisoformat(timestamp) if timestamp else None
+        return version, etag or None, last_modified, body
+
+    def file_key(self, file_id):
+        return 'file:%d' % file_id
+
+    def files_key(self, args):
+        params = '&'.join('%s=%s' % (k, v) for k, v in sorted(args.items(multi=True)))
+        return 'files:%s' % params
+
+    def invalidate_files(self, file_ids):
+        # entries of other versions are never served, this only frees them early
+        if self.backend is None:
+            return
+        try:
+            for file_id in file_ids:
+                self.backend.delete(self.file_key(file_id))
+        except Exception:
+            self.errors += 1
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "entries": len(self.backend) if self.backend is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors
+        }
+
+
+def setup_cache(app):
+    kind = os.environ.get('CACHE_BACKEND', 'local')
+    ttl = int(os.environ.get('CACHE_TTL', 300))
+    if kind == 'none':
+        backend = None
+    elif kind == 'redis':
+        backend = RedisCache.from_url(os.environ.get('CACHE_URL', 'redis://localhost:6379/0'), ttl=ttl)
+    else:
+        backend = LocalCache(max_entries=int(os.environ.get('CACHE_MAX_ENTRIES', 1024)), ttl=ttl)
+    cache = ResponseCache(backend)
+    app.extensions['cache'] = cache
+    return cache
+
+
+# the cache of the app handling the request, for the views
+file_cache = LocalProxy(lambda: current_app.extensions['cache'])
@@ -0,0 +1,196 @@
+"""
+Bookkeeping that has to happen in the same transaction as any write to files:
+the change log behind /files/changes and the facet counters behind
+/files/facets.
+
+Writes through the ORM (create_file, edit_file, delete_file, the admin) are
+picked up by the flush events below. Bulk writes that go around the ORM
+call record_file_changes() and update_facets() themselves before committing.
+After the commit the files written are dropped from the response cache.
+
+Change log versions come from an autoincrement: they are handed out at
+INSERT but become visible at COMMIT, so two writers could make 11 visible
+before 10, and a client syncing in between would move its token past 10 for
+good. Every append first updates the single file_change_lock row and holds
+that row lock until commit, so versions become visible in order: a token
+never skips a change that is committed later. The price is that writes to
+files are serialized from their change log append to their commit.
+"""
+from collections import Counter
+from datetime import datetime
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, inspect, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import db, Files, FileChange, FileChangeLock, FileFacet
+
+
+def lock_change_log(connection):
+    # held until the transaction ends, taking it again is a no-op
+    table = FileChangeLock.__table__
+    now = datetime.utcnow()
+    if connection.execute(table.update().values(locked_at=now)).rowcount == 0:
+        # tables made by create_all() instead of the migrations
+        connection.execute(table.insert().values(id=1, locked_at=now))
+
+
+def record_file_changes(session, upserted=(), deleted=()):
+    now = datetime.utcnow()
+    rows = [{"file_id": x, "op": FileChange.UPSERT, "changed_at": now} for x in upserted]
+    rows += [{"file_id": x, "op": FileChange.DELETE, "changed_at": now} for x in deleted]
+    if rows:
+        connection = session.connection()
+        lock_change_log(connection)
+        connection.execute(FileChange.__table__.insert(), rows)
+        session.info.setdefault('changed_files', set()).update(x["file_id"] for x in rows)
+
+
+def facet_key(row):
+    # works for Files objects, query rows and column dicts
+    if isinstance(row, dict):
+        return tuple(row[x] for x in FileFacet.COLUMNS)
+    return tuple(getattr(row, x) for x in FileFacet.COLUMNS)
+
+
+def update_facets(session, deltas):
+    # deltas is {facet_key: change in the number of files}
+    rows = [dict(zip(FileFacet.COLUMNS, key), count=delta) for key, delta in sorted(deltas.items()) if delta]
+    if not rows:
+        return
+    table = FileFacet.__table__
+    connection = session.connection()
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        # one executemany upsert, rows in key order so concurrent writers lock
+        # the counters in the same order
+        connection.execute(insert.on_conflict_do_update(
+            index_elements=list(FileFacet.COLUMNS),
+            set_={"count": table.c.count + insert.excluded.count}
+        ), rows)
+        return
+    for row in rows:
+        match = and_(*[table.c[x] == row[x] for x in FileFacet.COLUMNS])
+        result = connection.execute(table.update().where(match).values(count=table.c.count + row['count']))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row))
+
+
+def _previous_key(target):
+    # the facet the object was counted under before its pending changes
+    state = inspect(target)
+    key = []
+    for column in FileFacet.COLUMNS:
+        history = state.attrs[column].history
+        key.append(history.deleted[0] if history.deleted else getattr(target, column))
+    return tuple(key)
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_file_writes(session, flush_context, instances):
+    # new objects don't have an id yet, keep the objects until after the flush
+    new = [x for x in session.new if isinstance(x, Files)]
+    dirty = [x for x in session.dirty if isinstance(x, Files) and session.is_modified(x)]
+    deleted = [x for x in session.deleted if isinstance(x, Files)]
+    if not (new or dirty or deleted):
+        return
+    deltas = Counter()
+    for target in new:
+        deltas[facet_key(target)] += 1
+    for target in dirty:
+        deltas[_previous_key(target)] -= 1
+        deltas[facet_key(target)] += 1
+    for target in deleted:
+        deltas[_previous_key(target)] -= 1
+    session.info['file_writes'] = (new, dirty, deleted, deltas)
+
+
+@event.listens_for(Session, 'after_flush')
+def write_file_changes(session, flush_context):
+    writes = session.info.pop('file_writes', None)
+    if writes is None:
+        return
+    new, dirty, deleted, deltas = writes
+    record_file_changes(session, [x.id for x in new + dirty], [x.id for x in deleted])
+    update_facets(session, deltas)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_cached_files(session):
+    file_ids = session.info.pop('changed_files', None)
+    if file_ids and has_app_context():
+        cache = current_app.extensions.get('cache')
+        if cache is not None:
+            cache.invalidate_files(file_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changed_files(session):
+    session.info.pop('changed_files', None)
+
+
+def recount_facets(session):
+    # for files written around the ORM and this module (bench seed, imports),
+    # which log their own changes with record_file_changes()
+    connection = session.connection()
+    # before the facets, the order every other writer takes them in
+    lock_change_log(connection)
+    facets = FileFacet.__table__
+    files = Files.__table__
+    columns = [files.c[x] for x in FileFacet.COLUMNS]
+    connection.execute(facets.delete())
+    connection.execute(facets.insert().from_select(
+        list(FileFacet.COLUMNS) + ['count'],
+        db.select(columns + [func.count()]).group_by(*columns)
+    ))
+
+
+def facet_counts(args):
+    # counts for each facet under the filters on the other facets, so the
+    # values of a selected facet still show what picking another one returns
+    filters = {}
+    for param, column in Files.FILTERS.items():
+        if args.get(param):
+            filters[param] = getattr(FileFacet, column) == args.get(param)
+    total = func.sum(FileFacet.count)
+    result = {}
+    for param, column in Files.FILTERS.items():
+        column = getattr(FileFacet, column)
+        query = (db.session.query(column, total)
+                 .filter(*[x for other, x in filters.items() if other != param])
+                 .group_by(column).having(total > 0).order_by(column))
+        result[param] = {value: int(count) for value, count in query}
+    result["total"] = int(db.session.query(total).filter(*filters.values()).scalar() or 0)
+    return result
+
+
+def changes_since(since, limit, batch_size=500):
+    # the writes after version `since`, one entry per file with its latest state:
+    # files that still exist come back whole, the others as deleted ids
+    # versions are visible in order (see the module docstring), so nothing
+    # below the last one returned can still show up
+    changes = (FileChange.query.with_entities(FileChange.version, FileChange.file_id, FileChange.op)
+               .filter(FileChange.version > since).order_by(FileChange.version).limit(limit + 1).all())
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    latest = {}
+    for change in changes:
+        latest[change.file_id] = change.op
+    upserted = [x for x, op in latest.items() if op == FileChange.UPSERT]
+    files = []
+    for start in range(0, len(upserted), batch_size):
+        files += Files.query.filter(Files.id.in_(upserted[start:start + batch_size])).all()
+    found = set(x.id for x in files)
+    # an upsert whose file is gone was deleted by a later change past this page
+    deleted = sorted(x for x in latest if x not in found)
+    files.sort(key=lambda x: x.id)
+    return files, deleted, changes[-1].version if changes else since, has_more
+
+
+def latest_version():
+    return db.session.query(func.max(FileChange.version)).scalar() or 0
+
+
+def file_version(file_id):
+    # the last change of one file, 0 for a file that was never written
+    return db.session.query(func.max(FileChange.version)).filter(FileChange.file_id == file_id).scalar() or 0
@@ -0,0 +1,109 @@
+"""
+Engine settings from the environment, and read replica routing.
+
+Connection pool (ignored for SQLite):
+    DB_POOL_SIZE          connections kept open per worker
+    DB_MAX_OVERFLOW       extra connections opened under load
+    DB_POOL_TIMEOUT       seconds to wait for a free connection
+    DB_POOL_RECYCLE       seconds before a connection is replaced
+    DB_POOL_PRE_PING      1 (default) checks a connection before using it
+    DB_STATEMENT_TIMEOUT  milliseconds, Postgres and MySQL (mysqlclient)
+
+DB_REPLICA_CONNECTION_STRING adds a read-only bind. Views decorated with
+use_replica run their reads there; flushes, INSERT/UPDATE/DELETE and every
+other route keep using DB_CONNECTION_STRING. A replica lags behind the
+primary, so only pure reads that can be a moment stale belong there, and
+not the ones that fill the response cache: a stale entry would outlive the
+lag by CACHE_TTL.
+
+To try it locally point both at SQLite files, the replica a copy of the
+primary:
+
+    $ cp /tmp/jamfree.db /tmp/jamfree-replica.db
+    $ export DB_CONNECTION_STRING=sqlite:////tmp/jamfree.db
+    $ export DB_REPLICA_CONNECTION_STRING=sqlite:////tmp/jamfree-replica.db
+"""
+import os
+from functools import wraps
+from flask import current_app
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+
+REPLICA_BIND = 'replica'
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def engine_options(url):
+    options = {"pool_pre_ping": os.environ.get('DB_POOL_PRE_PING', '1') == '1'}
+    if url.startswith('sqlite'):
+        return options
+    for option, name in (('pool_size', 'DB_POOL_SIZE'), ('max_overflow', 'DB_MAX_OVERFLOW'),
+                         ('pool_timeout', 'DB_POOL_TIMEOUT'), ('pool_recycle', 'DB_POOL_RECYCLE')):
+        value = _env_int(name)
+        if value is not None:
+            options[option] = value
+    timeout = _env_int('DB_STATEMENT_TIMEOUT')
+    if timeout:
+        if url.startswith('postgres'):
+            options["connect_args"] = {"options": "-c statement_timeout=%d" % timeout}
+        elif url.startswith('mysql://') or url.startswith('mysql+mysqldb'):
+            options["connect_args"] = {"init_command": "SET SESSION MAX_EXECUTION_TIME=%d" % timeout}
+    return options
+
+
+class RoutingSession(SignallingSession):
+
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        # writes, and anything inside a flush, always go to the primary
+        if self.info.get(REPLICA_BIND) and not self._flushing and not getattr(clause, 'is_dml', False):
+            return self.db.get_engine(self.app, bind=REPLICA_BIND)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_from_replica():
+    # until the end of the request, streamed responses included
+    if REPLICA_BIND in current_app.config['SQLALCHEMY_BINDS']:
+        current_app.extensions['sqlalchemy'].db.session.info[REPLICA_BIND] = True
+
+
+def use_replica(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        read_from_replica()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def dispose_engines(app):
+    # in a forked worker: forget the connections inherited from the parent
+    # (without closing them, they are still the parent's) so the worker opens its own
+    state = app.extensions.get('sqlalchemy')
+    if state is None:
+        return
+    for engine in state.connectors.values():
+        engine.get_engine().dispose(close=False)
+
+
+def setup_database(app):
+    url = app.config['SQLALCHEMY_DATABASE_URI'] or ''
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    replica = os.environ.get('DB_REPLICA_CONNECTION_STRING')
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: replica} if replica else {}
+
+    @app.teardown_request
+    def leave_replica(exc):
+        app.extensions['sqlalchemy'].db.session.info.pop(REPLICA_BIND, None)
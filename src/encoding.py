@@ -0,0 +1,128 @@
+"""
+JSON encoding and response compression.
+
+JSON_PROVIDER picks the encoder behind jsonify, flask.json and the cache:
+    orjson  default, falls back to the standard library when orjson isn't
+            installed or can't encode a value
+    std     Flask's standard library provider
+
+Responses of at least COMPRESS_MIN_SIZE bytes are compressed with brotli
+(when the brotli package is installed) or gzip, whichever the client accepts
+and prefers. Streamed responses are compressed chunk by chunk. A compressed
+response gets a weak ETag, so conditional requests keep matching.
+"""
+import os
+import gzip
+import zlib
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # output keeps the sorted keys of the default provider so cached bodies
+    # and ETags don't change when switching providers
+
+    def dumps(self, obj, **kwargs):
+        kwargs.pop('separators', None)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if kwargs.pop('indent', None):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.pop('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except TypeError:
+            # e.g. integers past 64 bits
+            return super().dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def setup_json(app):
+    if os.environ.get('JSON_PROVIDER', 'orjson') == 'orjson' and orjson is not None:
+        app.json = OrjsonProvider(app)
+
+
+def choose_encoding():
+    accepted = request.accept_encodings
+    options = []
+    if brotli is not None and accepted['br']:
+        options.append((accepted['br'], 1, 'br'))
+    if accepted['gzip']:
+        options.append((accepted['gzip'], 0, 'gzip'))
+    if not options:
+        return None
+    # highest q first, brotli wins ties
+    return max(options)[2]
+
+
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+            data += compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+            # flush so the client gets each batch as soon as it is produced
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def compress_response(response):
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or request.method == 'HEAD'):
+        return response
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        if encoding == 'br':
+            response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+        else:
+            response.set_data(gzip.compress(data, GZIP_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def setup_compression(app):
+    app.after_request(compress_response)
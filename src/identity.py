@@ -0,0 +1,145 @@
+"""
+Who is calling, without a database round trip per request.
+
+Tokens from /login carry the user id (uid) and the user's version (ver) next
+to the email in sub. The version goes up when the email, password or account
+type changes, which revokes the tokens issued before. identity_required checks
+the token like jwt_required and then resolves the caller through a per-worker
+cache of (id, email, account_type, version) rows:
+
+- entries live IDENTITY_CACHE_TTL seconds, at most IDENTITY_CACHE_SIZE of them
+- commits that change or delete a user evict it in this worker
+- a token with a newer ver than the cached row (the user changed in another
+  worker and logged in again) reloads it
+- a token with an older ver than the cached row gets a 401, as does a token
+  of a deleted user
+
+The other workers only learn about a change when their entry expires, so a
+revoked token or a deleted user keeps working there for up to
+IDENTITY_CACHE_TTL seconds. Keep it short.
+"""
+import os
+import time
+import threading
+from functools import wraps
+from itertools import chain
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app, g
+from flask_jwt_simple import jwt_required, get_jwt
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from utils import APIException
+from models import db, User
+
+IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 10))
+IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+# changing any of these revokes the user's tokens
+CREDENTIAL_COLUMNS = ('email', 'password', 'account_type')
+
+
+def load_identity(*criteria):
+    return db.session.query(User.id, User.email, User.account_type, User.version).filter(*criteria).first()
+
+
+class IdentityCache:
+
+    def __init__(self, ttl=IDENTITY_CACHE_TTL, max_entries=IDENTITY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # user id -> (expires, identity row)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, version=0):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic() and entry[1].version >= version:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        identity = load_identity(User.id == user_id)
+        with self.lock:
+            if identity is None:
+                self.entries.pop(user_id, None)
+                return None
+            self.entries[user_id] = (time.monotonic() + self.ttl, identity)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+
+identity_cache = IdentityCache()
+
+
+def jwt_data(user):
+    # create_jwt(identity=<User>): the default claims plus uid and ver
+    now = datetime.utcnow()
+    return {
+        'exp': now + current_app.config['JWT_EXPIRES'],
+        'iat': now,
+        'nbf': now,
+        current_app.config['JWT_IDENTITY_CLAIM']: user.email,
+        'uid': user.id,
+        'ver': user.version
+    }
+
+
+def identity_required(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        claims = get_jwt()
+        if 'uid' in claims:
+            identity = identity_cache.get(claims['uid'], claims.get('ver', 0))
+            if identity is not None and identity.version > claims.get('ver', 0):
+                raise APIException('Token has been revoked', 401)
+        else:
+            # tokens issued before uid was added, gone once they expire
+            identity = load_identity(User.email == claims.get(current_app.config['JWT_IDENTITY_CLAIM']))
+        if identity is None:
+            raise APIException('User not found', 401)
+        g.identity = identity
+        return fn(*args, **kwargs)
+    return jwt_required(wrapper)
+
+
+def current_identity():
+    return g.get('identity')
+
+
+@event.listens_for(Session, 'before_flush')
+def bump_user_versions(session, flush_context, instances):
+    for user in session.dirty:
+        if isinstance(user, User) and any(inspect(user).attrs[x].history.has_changes() for x in CREDENTIAL_COLUMNS):
+            user.version = User.version + 1
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_user_writes(session, flush_context):
+    user_ids = [x.id for x in chain(session.dirty, session.deleted) if isinstance(x, User)]
+    if user_ids:
+        session.info.setdefault('identity_users', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def evict_user_writes(session):
+    user_ids = session.info.pop('identity_users', None)
+    if user_ids:
+        identity_cache.invalidate(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_user_writes(session):
+    session.info.pop('identity_users', None)
+
+
+def setup_identity(jwt):
+    jwt.jwt_data_loader(jwt_data)
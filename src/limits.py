@@ -0,0 +1,209 @@
+"""
+Admission control for the expensive routes.
+
+Rate limits: every client (by IP address) has a token bucket per route group.
+A bucket holds up to <burst> requests and refills at <rate> per second; a
+request that finds it empty gets a 429 with Retry-After set to when the next
+token is due. RATE_LIMITS overrides the defaults, as group=rate/burst pairs
+(rate above 0, burst of at least 1):
+
+    RATE_LIMITS=login=1/10,users=2/10,files=20/50
+
+Concurrency: the heavy groups (users, files) run at most RATE_LIMIT_CONCURRENCY
+requests at once per worker; past that the request gets a 503 with
+Retry-After: 1 at once instead of waiting for a thread. It only matters with
+threaded workers (GUNICORN_THREADS > 1).
+
+Behind a proxy the client address is read from X-Forwarded-For, trusting
+RATE_LIMIT_PROXIES proxies in front of the app. It defaults to 1 on Heroku
+(where DYNO is set) and 0 elsewhere; with 0 behind a proxy every client has
+the proxy's address and shares one bucket.
+
+RATE_LIMIT_BACKEND holds the buckets:
+    local  in-process (default); each gunicorn worker counts on its own, so
+           a client gets up to workers x the limit
+    redis  shared by every worker, needs the redis package and
+           RATE_LIMIT_URL (CACHE_URL by default)
+    none   disables the limits
+A store that fails lets requests through, limits must not take the API down.
+"""
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from flask import request, g, current_app, jsonify
+
+DEFAULT_LIMITS = 'login=1/10,users=2/10,files=20/50'
+# endpoint -> route group
+ROUTE_GROUPS = {
+    'api.login': 'login',
+    'api.get_all_users': 'users',
+    'api.get_all_files': 'files',
+    'api.search_all_files': 'files',
+    'api.get_file_facets': 'files',
+    'api.get_file_changes': 'files'
+}
+HEAVY_GROUPS = ('users', 'files')
+
+
+def parse_limits(value):
+    limits = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        group, _, rule = item.partition('=')
+        rate, _, burst = rule.partition('/')
+        rate, burst = float(rate), int(burst or 1)
+        # a bucket that never refills would divide by zero in take()
+        if not rate > 0 or burst < 1:
+            raise ValueError('RATE_LIMITS: %s needs a rate above 0 and a burst of at least 1' % item.strip())
+        limits[group.strip()] = (rate, burst)
+    return limits
+
+
+class LocalBuckets:
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()  # key -> (tokens, updated)
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        # seconds until a token is available, 0 when one was taken
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_entries:
+                # the least recently seen clients, their buckets were full again anyway
+                self.buckets.popitem(last=False)
+        return wait
+
+
+# refill and take in one step, so workers never both take the last token
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    # any client with the redis-py interface works, e.g. fakeredis in local runs
+
+    def __init__(self, client, prefix='jamfree:limit:'):
+        self.prefix = prefix
+        self.script = client.register_script(TAKE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def take(self, key, rate, burst):
+        return float(self.script(keys=[self.prefix + key], args=[rate, burst, time.time()]))
+
+
+class Limiter:
+
+    def __init__(self, buckets, limits, concurrency, proxies=0):
+        self.buckets = buckets
+        self.limits = limits
+        self.proxies = proxies
+        # in-flight heavy requests, per worker
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.limited = 0
+        self.shed = 0
+        self.errors = 0
+
+    def client(self):
+        if self.proxies and len(request.access_route) >= self.proxies:
+            # the address the first trusted proxy saw, earlier entries can be forged
+            return request.access_route[-self.proxies]
+        return request.remote_addr or 'unknown'
+
+    def take(self, group):
+        rate, burst = self.limits[group]
+        try:
+            return self.buckets.take('%s:%s' % (group, self.client()), rate, burst)
+        except Exception:
+            self.errors += 1
+            return 0.0
+
+
+def _refuse(message, status, retry_after):
+    response = jsonify({"message": message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response
+
+
+def before_request():
+    group = ROUTE_GROUPS.get(request.endpoint)
+    if group is None:
+        return None
+    limiter = current_app.extensions['limiter']
+    if group in limiter.limits:
+        wait = limiter.take(group)
+        if wait > 0:
+            limiter.limited += 1
+            return _refuse('Too many requests, try again later', 429, wait)
+    if group in HEAVY_GROUPS:
+        if not limiter.slots.acquire(blocking=False):
+            limiter.shed += 1
+            return _refuse('Server busy, try again later', 503, 1)
+        g.limit_slot = True
+    return None
+
+
+def teardown_request(exc):
+    # after the whole body for streamed responses (stream_with_context)
+    if g.pop('limit_slot', None):
+        current_app.extensions['limiter'].slots.release()
+
+
+def default_proxies():
+    # Heroku's router is in front of every dyno
+    return 1 if os.environ.get('DYNO') else 0
+
+
+def setup_limits(app):
+    kind = os.environ.get('RATE_LIMIT_BACKEND', 'local')
+    if kind == 'none':
+        app.extensions['limiter'] = None
+        return None
+    if kind == 'redis':
+        buckets = RedisBuckets.from_url(os.environ.get('RATE_LIMIT_URL', os.environ.get('CACHE_URL', 'redis://localhost:6379/0')))
+    else:
+        buckets = LocalBuckets(max_entries=int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', 100000)))
+    limiter = Limiter(
+        buckets,
+        parse_limits(os.environ.get('RATE_LIMITS', DEFAULT_LIMITS)),
+        int(os.environ.get('RATE_LIMIT_CONCURRENCY', 4)),
+        int(os.environ.get('RATE_LIMIT_PROXIES', default_proxies()))
+    )
+    app.extensions['limiter'] = limiter
+    app.before_request(before_request)
+    app.teardown_request(teardown_request)
+    return limiter
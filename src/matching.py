@@ -0,0 +1,187 @@
+"""
+Teacher matching for students, served from an in-memory index.
+
+Teachers are indexed by instrument, then language, then level. A teacher
+matches when they teach the student's instrument; the ones that also share the
+student's language and level come first (score 3), then same language (2),
+then same level (1), then the rest (0), by user id within each score.
+
+The index is built on the first lookup. Commits that touch users or teachers
+mark those users stale, and they are reloaded with one query before the next
+lookup. Writes made by other processes (the other gunicorn workers) are picked
+up by a full rebuild every MATCH_INDEX_TTL seconds. The rebuild is loaded next
+to the index in use and swapped in, so only the lookups before the very first
+build wait for it; meanwhile the others are answered from the old index.
+"""
+import os
+import time
+import bisect
+import heapq
+import threading
+from itertools import chain, islice
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import db, User, Teacher, Student
+
+MATCH_INDEX_TTL = int(os.environ.get('MATCH_INDEX_TTL', 300))
+
+
+class MatchIndex:
+
+    def __init__(self, ttl=MATCH_INDEX_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.teachers = {}  # user id -> (instrument, language, level)
+        self.buckets = {}   # instrument -> language -> level -> sorted user ids
+        self.stale = set()
+        self.built_at = None
+        # one full rebuild at a time
+        self.building = threading.Lock()
+        # one refresh at a time, so an older load is never applied over a newer one
+        self.refreshing = threading.Lock()
+
+    def _load(self, user_ids=None):
+        query = (db.session.query(Teacher.user_id, Teacher.instrument, User.language, User.level)
+                 .join(User, User.id == Teacher.user_id))
+        if user_ids is not None:
+            query = query.filter(Teacher.user_id.in_(user_ids))
+        return query.all()
+
+    def _add(self, user_id, key):
+        self.teachers[user_id] = key
+        instrument, language, level = key
+        ids = self.buckets.setdefault(instrument, {}).setdefault(language, {}).setdefault(level, [])
+        bisect.insort(ids, user_id)
+
+    def _remove(self, user_id):
+        key = self.teachers.pop(user_id, None)
+        if key is None:
+            return
+        instrument, language, level = key
+        by_language = self.buckets[instrument]
+        ids = by_language[language][level]
+        del ids[bisect.bisect_left(ids, user_id)]
+        # drop empty buckets so the walks in match() stay short
+        if not ids:
+            del by_language[language][level]
+            if not by_language[language]:
+                del by_language[language]
+                if not by_language:
+                    del self.buckets[instrument]
+
+    def _expired(self):
+        return self.built_at is None or time.monotonic() - self.built_at > self.ttl
+
+    def _rebuild(self):
+        # without the lock held
+        if not self._expired():
+            return
+        if not self.building.acquire(blocking=self.built_at is None):
+            return
+        try:
+            if not self._expired():
+                # built by the thread we waited for
+                return
+            started = time.monotonic()
+            fresh = MatchIndex(self.ttl)
+            for row in fresh._load():
+                fresh._add(row.user_id, (row.instrument, row.language, row.level))
+            with self.lock:
+                # users marked stale meanwhile stay marked, _refresh() reloads
+                # them in case the rebuild read them before their commit
+                self.teachers, self.buckets = fresh.teachers, fresh.buckets
+                self.built_at = started
+        finally:
+            self.building.release()
+
+    def _refresh(self):
+        # without the lock held, lookups go on from the index while the users load
+        if not self.stale:
+            return
+        with self.refreshing:
+            with self.lock:
+                user_ids, self.stale = self.stale, set()
+            if not user_ids:
+                return
+            try:
+                rows = self._load(user_ids)
+            except Exception:
+                # still stale, the next lookup tries again
+                with self.lock:
+                    self.stale.update(user_ids)
+                raise
+            with self.lock:
+                for user_id in user_ids:
+                    self._remove(user_id)
+                for row in rows:
+                    self._add(row.user_id, (row.instrument, row.language, row.level))
+
+    def mark_stale(self, user_ids):
+        with self.lock:
+            self.stale.update(user_ids)
+
+    def match(self, instrument, language, level, limit):
+        self._rebuild()
+        self._refresh()
+        with self.lock:
+            by_language = self.buckets.get(instrument, {})
+            same_language = by_language.get(language, {})
+            other_languages = [levels for key, levels in by_language.items() if key != language]
+            groups = (
+                (3, [same_language.get(level, [])]),
+                (2, [ids for key, ids in same_language.items() if key != level]),
+                (1, [levels.get(level, []) for levels in other_languages]),
+                (0, [ids for levels in other_languages for key, ids in levels.items() if key != level])
+            )
+            matches = []
+            for score, lists in groups:
+                # every list is sorted, merge lazily and stop at the limit
+                for user_id in islice(heapq.merge(*lists), limit - len(matches)):
+                    matches.append((user_id, score))
+                if len(matches) == limit:
+                    break
+            return [self._serialize(user_id, score) for user_id, score in matches]
+
+    def _serialize(self, user_id, score):
+        instrument, language, level = self.teachers[user_id]
+        return {
+            "user_id": user_id,
+            "score": score,
+            "instrument": instrument,
+            "language": language,
+            "level": level
+        }
+
+
+def student_profile(user_id):
+    # (instrument, language, level) of the student with this user id, or None
+    return (db.session.query(Student.instrument, User.language, User.level)
+            .join(User, User.id == Student.user_id)
+            .filter(Student.user_id == user_id).first())
+
+
+match_index = MatchIndex()
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_match_writes(session, flush_context):
+    user_ids = session.info.setdefault('match_users', set())
+    for target in chain(session.new, session.dirty, session.deleted):
+        if isinstance(target, User):
+            user_ids.add(target.id)
+        elif isinstance(target, Teacher):
+            # a teacher row moved to another user leaves the old one stale too
+            user_ids.update(inspect(target).attrs.user_id.history.deleted)
+            user_ids.add(target.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_match_writes(session):
+    user_ids = session.info.pop('match_users', None)
+    if user_ids:
+        match_index.mark_stale(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_match_writes(session):
+    session.info.pop('match_users', None)
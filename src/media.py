@@ -0,0 +1,200 @@
+"""
+Cleanup of uploaded media that nothing points to any more.
+
+Deleting a user or a file, or replacing a profile picture or a file url,
+leaves the old asset at the uploader. Deleting it there during the request
+would add a remote call to it, so the url goes to the MediaOrphan outbox in
+the same transaction instead, and `flask media cleanup` drains the outbox in
+batches:
+
+- a batch is claimed for MEDIA_CLEANUP_LEASE seconds, so several cleaners can
+  run side by side and the entries of one that dies are picked up again
+- an url that is still in use (the same picture uploaded again is
+  deduplicated through MediaAsset and gets the same url) is dropped; the
+  MediaAsset row is locked while that is checked, see UploadQueue.submit
+- the rest is removed with one delete_many call to the uploader per batch and
+  resource type
+- failures are retried with exponential backoff, from MEDIA_CLEANUP_BACKOFF up
+  to MEDIA_CLEANUP_MAX_BACKOFF seconds; after MEDIA_CLEANUP_MAX_ATTEMPTS the
+  entry stays in the table with its last error and is no longer tried
+
+Run it with UPLOADER=local to try it without Cloudinary.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, bindparam
+from sqlalchemy.orm import Session
+from models import db, User, Files, MediaAsset, MediaOrphan
+from uploads import get_uploader
+
+MEDIA_CLEANUP_BATCH_SIZE = int(os.environ.get('MEDIA_CLEANUP_BATCH_SIZE', 100))
+MEDIA_CLEANUP_LEASE = int(os.environ.get('MEDIA_CLEANUP_LEASE', 300))
+MEDIA_CLEANUP_BACKOFF = int(os.environ.get('MEDIA_CLEANUP_BACKOFF', 60))
+MEDIA_CLEANUP_MAX_BACKOFF = int(os.environ.get('MEDIA_CLEANUP_MAX_BACKOFF', 6 * 3600))
+MEDIA_CLEANUP_MAX_ATTEMPTS = int(os.environ.get('MEDIA_CLEANUP_MAX_ATTEMPTS', 10))
+
+# the columns holding uploaded urls, per model
+MEDIA_COLUMNS = {User: 'profile_picture', Files: 'url'}
+
+
+def record_orphans(session, urls):
+    urls = set(x for x in urls if x)
+    if urls:
+        session.connection().execute(MediaOrphan.__table__.insert(), [{"url": x} for x in sorted(urls)])
+
+
+def _replaced_url(target, column):
+    history = inspect(target).attrs[column].history
+    return history.deleted[0] if history.deleted else None
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_orphans(session, flush_context, instances):
+    urls = []
+    for target in session.deleted:
+        column = MEDIA_COLUMNS.get(type(target))
+        if column is not None:
+            urls.append(_replaced_url(target, column) or getattr(target, column))
+    for target in session.dirty:
+        column = MEDIA_COLUMNS.get(type(target))
+        if column is not None:
+            urls.append(_replaced_url(target, column))
+    urls = [x for x in urls if x]
+    if urls:
+        session.info.setdefault('media_orphans', []).extend(urls)
+
+
+@event.listens_for(Session, 'after_flush')
+def write_orphans(session, flush_context):
+    urls = session.info.pop('media_orphans', None)
+    if urls:
+        record_orphans(session, urls)
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(MEDIA_CLEANUP_BACKOFF * 2 ** (attempts - 1), MEDIA_CLEANUP_MAX_BACKOFF))
+
+
+def _claim(batch_size, now):
+    table = MediaOrphan.__table__
+    query = db.session.query(MediaOrphan.id, MediaOrphan.url, MediaOrphan.attempts).filter(
+        MediaOrphan.next_attempt_at <= now,
+        MediaOrphan.attempts < MEDIA_CLEANUP_MAX_ATTEMPTS
+    ).order_by(MediaOrphan.next_attempt_at).limit(batch_size)
+    if db.session.connection().dialect.name in ('postgresql', 'mysql'):
+        # concurrent cleaners take different batches instead of waiting on each other
+        query = query.with_for_update(skip_locked=True)
+    entries = query.all()
+    if entries:
+        db.session.execute(table.update().where(table.c.id.in_([x.id for x in entries]))
+                           .values(next_attempt_at=now + timedelta(seconds=MEDIA_CLEANUP_LEASE)))
+    db.session.commit()
+    return entries
+
+
+def _in_use(urls):
+    used = set()
+    for column in (User.profile_picture, Files.url):
+        used.update(x[0] for x in db.session.query(column).filter(column.in_(urls)))
+    return used
+
+
+def cleanup_batch(uploader, batch_size=MEDIA_CLEANUP_BATCH_SIZE):
+    # returns counts of what happened to the claimed entries, None when there was nothing to do
+    now = datetime.utcnow()
+    entries = _claim(batch_size, now)
+    if not entries:
+        return None
+    stats = {"claimed": len(entries), "in_use": 0, "foreign": 0, "deleted": 0, "failed": 0}
+    urls = set(x.url for x in entries)
+    # lock the MediaAsset rows before looking for users of the urls, uploads
+    # that deduplicate onto one lock it too: they either commit first and the
+    # url shows up as in use, or wait and find the asset gone
+    assets = MediaAsset.query.filter(MediaAsset.url.in_(urls)).with_for_update().all()
+    used = _in_use(urls)
+
+    # pictures that go away leave MediaAsset too, so the same bytes are
+    # uploaded again instead of pointing at a deleted asset; their thumbnail
+    # becomes an entry of its own
+    assets = [x for x in assets if x.url not in used]
+    record_orphans(db.session, [x.thumbnail_url for x in assets])
+    for asset in assets:
+        db.session.delete(asset)
+
+    done = []
+    targets = {}  # resource type -> public id -> entries
+    for entry in entries:
+        if entry.url in used:
+            stats["in_use"] += 1
+            done.append(entry.id)
+            continue
+        asset_id = uploader.asset_id(entry.url)
+        if asset_id is None:
+            # not uploaded by us (external link, other cloud), nothing to delete
+            stats["foreign"] += 1
+            done.append(entry.id)
+            continue
+        targets.setdefault(asset_id[0], {}).setdefault(asset_id[1], []).append(entry)
+    db.session.commit()
+
+    failed = []
+    for resource_type, by_id in targets.items():
+        try:
+            gone, error = uploader.delete_many(list(by_id), resource_type), 'not deleted'
+        except Exception as e:
+            gone, error = set(), str(e)[:200]
+        for public_id, queued in by_id.items():
+            for entry in queued:
+                if public_id in gone:
+                    stats["deleted"] += 1
+                    done.append(entry.id)
+                else:
+                    stats["failed"] += 1
+                    attempts = entry.attempts + 1
+                    failed.append({"_id": entry.id, "attempts": attempts,
+                                   "next_attempt_at": now + backoff(attempts), "error": error})
+
+    table = MediaOrphan.__table__
+    if done:
+        db.session.execute(table.delete().where(table.c.id.in_(done)))
+    if failed:
+        db.session.execute(table.update().where(table.c.id == bindparam('_id')).values(
+            attempts=bindparam('attempts'), next_attempt_at=bindparam('next_attempt_at'), error=bindparam('error')
+        ), failed)
+    db.session.commit()
+    return stats
+
+
+media_cli = AppGroup('media', help='Maintenance of uploaded media.')
+
+
+@media_cli.command('cleanup')
+@click.option('--batch-size', type=int, default=MEDIA_CLEANUP_BATCH_SIZE, show_default=True)
+@click.option('--loop', is_flag=True, help='keep running, waiting --interval seconds whenever the outbox is empty')
+@click.option('--interval', type=float, default=30, show_default=True)
+def cleanup_command(batch_size, loop, interval):
+    """Delete the assets queued in the media outbox."""
+    uploader = get_uploader()
+    totals = {}
+    while True:
+        stats = cleanup_batch(uploader, batch_size)
+        if stats is not None:
+            click.echo(' '.join('%s=%d' % x for x in stats.items()), err=True)
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+            continue
+        if not loop:
+            break
+        db.session.remove()
+        time.sleep(interval)
+    gave_up = MediaOrphan.query.filter(MediaOrphan.attempts >= MEDIA_CLEANUP_MAX_ATTEMPTS).count()
+    click.echo('done: %s, %d entries past %d attempts' % (
+        ' '.join('%s=%d' % x for x in totals.items()) or 'nothing to clean', gave_up, MEDIA_CLEANUP_MAX_ATTEMPTS
+    ), err=True)
+
+
+def setup_media(app):
+    app.cli.add_command(media_cli)
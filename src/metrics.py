@@ -0,0 +1,111 @@
+"""
+Request and database metrics in Prometheus text format at /metrics.
+
+Per endpoint (the url rule, so /file/<int:file_id> is one series):
+latency histogram, responses by status, requests in flight, and the number
+of SQL statements and time spent in the database for each request.
+
+With several gunicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty
+directory shared by the workers: each process writes its samples there and
+/metrics adds them up, whichever worker answers the scrape. Dead workers are
+cleaned up by calling child_exit from the gunicorn config.
+"""
+import os
+import time
+from flask import request, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from prometheus_client import (
+    Counter, Histogram, Gauge, CollectorRegistry, REGISTRY,
+    generate_latest, CONTENT_TYPE_LATEST, multiprocess
+)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent handling the request',
+    ['method', 'endpoint']
+)
+REQUEST_COUNT = Counter(
+    'http_requests_total', 'Responses sent',
+    ['method', 'endpoint', 'status']
+)
+IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'Requests being handled',
+    ['endpoint'], multiprocess_mode='livesum'
+)
+DB_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL statements issued by a request',
+    ['method', 'endpoint'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500, float('inf'))
+)
+DB_TIME = Histogram(
+    'http_request_db_seconds', 'Time spent waiting on the database during a request',
+    ['method', 'endpoint']
+)
+
+
+def _endpoint():
+    # the rule instead of the path keeps the number of series bounded
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_endpoint = _endpoint()
+    g.sql_queries = 0
+    g.sql_time = 0.0
+    IN_FLIGHT.labels(g.metrics_endpoint).inc()
+
+
+def after_request(response):
+    if 'metrics_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.metrics_start
+    endpoint = g.metrics_endpoint
+    REQUEST_LATENCY.labels(request.method, endpoint).observe(elapsed)
+    REQUEST_COUNT.labels(request.method, endpoint, str(response.status_code)).inc()
+    DB_QUERIES.labels(request.method, endpoint).observe(g.sql_queries)
+    DB_TIME.labels(request.method, endpoint).observe(g.sql_time)
+    response.headers['Server-Timing'] = 'db;dur=%.2f, app;dur=%.2f' % (g.sql_time * 1000, elapsed * 1000)
+    return response
+
+
+def teardown_request(exc):
+    # runs even when after_request didn't, so the gauge can't leak
+    if g.pop('metrics_start', None) is not None:
+        IN_FLIGHT.labels(g.metrics_endpoint).dec()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # on the execution context, not the connection: a statement that fails never
+    # reaches after_cursor_execute and would leave its start time behind
+    context.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_start
+    # queries from background threads (uploads) have no request to charge
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_time += elapsed
+
+
+def metrics_view():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def setup_metrics(app):
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
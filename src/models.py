@@ -1,13 +1,26 @@
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+from sqlalchemy.orm import joinedload, selectinload
+from database import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
+
+
+# sparse fieldsets (?fields=): every model lists the names serialize() emits
+# in FIELD_COLUMNS, mapped to the column that holds each one
+def field_columns(model, fields):
+    return [getattr(model, model.FIELD_COLUMNS[field]) for field in fields]
+
+def serialize_fields(model, row, fields):
+    # row can be a model instance or a row from query.with_entities()
+    return {field: getattr(row, model.FIELD_COLUMNS[field]) for field in fields}
 
-db = SQLAlchemy()
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(80), unique=False, nullable=False)
     last_name = db.Column(db.String(80), unique=False, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(80), unique=False, nullable=False)
+    password = db.Column(db.String(255), unique=False, nullable=False)
     account_type = db.Column(db.String(80), unique=False, nullable=False)
     language = db.Column(db.String(80), unique=False, nullable=False)
     username = db.Column(db.String(120), unique=True, nullable=True)
@@ -16,15 +29,53 @@ class User(db.Model):
     description = db.Column(db.String(120), unique=False, nullable=True)
     teacher = db.relationship('Teacher', backref='user', uselist=False, lazy=True)
     student = db.relationship('Student', backref='user', uselist=False, lazy=True)
-    files = db.relationship('Files', backref='user', uselist=False, lazy=True)
+    files = db.relationship('Files', backref='user', lazy=True, order_by='Files.id')
     customer_id = db.Column(db.String(50), unique=False, nullable=False)
-    profile_picture = db.Column(db.String(200), unique=False, nullable=True)
+    # indexed for the media cleanup, which checks an url is no longer used before deleting it
+    profile_picture = db.Column(db.String(200), unique=False, nullable=True, index=True)
+    profile_thumbnail = db.Column(db.String(200), unique=False, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
+    # bumped when the credentials change (identity.py), tokens carry it as the ver claim
+    version = db.Column(db.Integer, default=1, nullable=False)
 
 
+    # related rows that can be added to serialize() with ?include=
+    INCLUDES = ('files', 'teacher', 'student')
+    FIELD_COLUMNS = {x: x for x in (
+        "id", "first_name", "last_name", "email", "account_type", "language", "username",
+        "instrument", "level", "description", "customer_id", "profile_picture", "profile_thumbnail"
+    )}
+
     def __repr__(self):
         return '<User %r>' % self.account_type
 
-    def serialize(self):
+    @staticmethod
+    def include_options(include):
+        # teacher and student are one row per user and come in the same query
+        # with a join, files come in one extra IN query for the whole page of users
+        options = []
+        if 'files' in include:
+            options.append(selectinload(User.files))
+        if 'teacher' in include:
+            options.append(joinedload(User.teacher))
+        if 'student' in include:
+            options.append(joinedload(User.student))
+        return options
+
+    def serialize(self, include=(), fields=None):
+        if fields:
+            data = serialize_fields(User, self, fields)
+        else:
+            data = self._serialize()
+        if 'files' in include:
+            data["files"] = list(map(lambda x: x.serialize(), self.files))
+        if 'teacher' in include:
+            data["teacher"] = self.teacher.serialize() if self.teacher is not None else None
+        if 'student' in include:
+            data["student"] = self.student.serialize() if self.student is not None else None
+        return data
+
+    def _serialize(self):
         return {
             "id": self.id,
             "first_name": self.first_name,
@@ -37,41 +88,190 @@ class User(db.Model):
             "level": self.level,
             "description": self.description,
             "customer_id": self.customer_id,
-            "profile_picture": self.profile_picture
+            "profile_picture": self.profile_picture,
+            "profile_thumbnail": self.profile_thumbnail
+        }
+
+class FileChange(db.Model):
+    # append-only log of writes to files, version is the sync token
+    version = db.Column(db.Integer, primary_key=True)
+    # no foreign key: the tombstone of a deleted file has to outlive the file
+    file_id = db.Column(db.Integer, nullable=False, index=True)
+    op = db.Column(db.String(10), unique=False, nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # versions are never reused, even after the last rows are removed
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+
+    def __repr__(self):
+        return '<FileChange %r>' % self.version
+
+
+class FileChangeLock(db.Model):
+    # a single row, updated before every append to file_change so appends
+    # are serialized until commit (see catalog.py)
+    id = db.Column(db.Integer, primary_key=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return '<FileChangeLock %r>' % self.locked_at
+
+class FileFacet(db.Model):
+    # number of files per combination of the filter columns, kept up to date
+    # on every write so facet counts never have to scan files
+    id = db.Column(db.Integer, primary_key=True)
+    instrument = db.Column(db.String(120), nullable=False)
+    level = db.Column(db.String(120), nullable=False)
+    language = db.Column(db.String(120), nullable=False)
+    type_file = db.Column(db.String(120), nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+    COLUMNS = ('instrument', 'level', 'language', 'type_file')
+
+    __table_args__ = (
+        db.UniqueConstraint(*COLUMNS),
+    )
+
+    def __repr__(self):
+        return '<FileFacet %r>' % self.id
+
+class MediaAsset(db.Model):
+    # one row per distinct uploaded picture, keyed by the sha256 of its bytes
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    url = db.Column(db.String(200), unique=False, nullable=False, index=True)
+    public_id = db.Column(db.String(200), unique=False, nullable=True)
+    thumbnail_url = db.Column(db.String(200), unique=False, nullable=True)
+    thumbnail_public_id = db.Column(db.String(200), unique=False, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return '<MediaAsset %r>' % self.id
+
+class MediaOrphan(db.Model):
+    # outbox of uploaded media no longer used, drained by `flask media cleanup`
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(200), unique=False, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    error = db.Column(db.String(200), unique=False, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return '<MediaOrphan %r>' % self.id
+
+class UploadJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String(20), unique=False, nullable=False, default='pending')
+    result_url = db.Column(db.String(200), unique=False, nullable=True)
+    error = db.Column(db.String(200), unique=False, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
+
+    def __repr__(self):
+        return '<UploadJob %r>' % self.id
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "result_url": self.result_url,
+            "error": self.error
         }
 
 class Teacher(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     instrument= db.Column(db.String(120), unique=False, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
 
 
     def __repr__(self):
         return '<Teacher %r>' % self.id
 
+    def serialize(self):
+        return {
+            "id": self.id,
+            "instrument": self.instrument,
+            "user_id": self.user_id
+        }
+
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     instrument = db.Column(db.String(120), unique=False, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
 
 
     def __repr__(self):
         return '<User %r>' % self.id
 
+    def serialize(self):
+        return {
+            "id": self.id,
+            "instrument": self.instrument,
+            "user_id": self.user_id
+        }
+
 class Files(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     instrument = db.Column(db.String(120), unique=False, nullable=False)
     type_file = db.Column(db.String(120), unique=False, nullable=False)
     level = db.Column(db.String(120), unique=False, nullable=False)
     language = db.Column(db.String(120), unique=False, nullable=False)
-    url = db.Column(db.String(120), unique=False, nullable=False)
+    url = db.Column(db.String(120), unique=False, nullable=False, index=True)
     title = db.Column(db.String(120), unique= False, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id')) # agregarlo a los usuario
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True) # agregarlo a los usuario
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
+
+    # composite indexes ending in the primary key so a filtered page is
+    # a single range scan: WHERE <column> = ? AND id > <cursor> ORDER BY id
+    __table_args__ = (
+        db.Index('ix_files_instrument_id', 'instrument', 'id'),
+        db.Index('ix_files_level_id', 'level', 'id'),
+        db.Index('ix_files_language_id', 'language', 'id'),
+        db.Index('ix_files_type_file_id', 'type_file', 'id'),
+    )
+
+    # request/response field -> column, same names used by serialize()
+    FIELDS = {
+        "instrument": "instrument",
+        "typeFile": "type_file",
+        "level": "level",
+        "language": "language",
+        "url": "url",
+        "userId": "user_id",
+        "title": "title"
+    }
+    REQUIRED_FIELDS = ("instrument", "typeFile", "level", "language", "url", "title")
+    FIELD_COLUMNS = dict(id="id", **FIELDS)
+
+    # query string parameter -> column
+    FILTERS = {
+        "instrument": "instrument",
+        "level": "level",
+        "language": "language",
+        "typeFile": "type_file"
+    }
 
     def __repr__(self):
             return '<Files %r>' % self.id
 
-    def serialize(self):
+    @classmethod
+    def filter_by_args(cls, args):
+        query = cls.query
+        for param, column in cls.FILTERS.items():
+            value = args.get(param)
+            if value:
+                query = query.filter(getattr(cls, column) == value)
+        return query
+
+    def serialize(self, fields=None):
+        if fields:
+            return serialize_fields(Files, self, fields)
         return {
              "id": self.id,
              "instrument": self.instrument,
@@ -0,0 +1,90 @@
+"""
+Password hashing.
+
+Passwords are stored as werkzeug PBKDF2-SHA256 hashes. The cost is
+PASSWORD_HASH_ROUNDS iterations: every doubling doubles the time of a login
+and of a guess. Rows still holding a plaintext password, or a hash made with
+other settings, are rehashed with the current ones at the next successful
+login.
+
+Hashing and checking run in a small pool of PASSWORD_WORKERS threads
+(hashlib releases the GIL while it works). At most PASSWORD_QUEUE_SIZE more
+wait for a thread; past that logins get a 503 instead of taking the CPU
+from every other route.
+"""
+import os
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from utils import APIException
+
+PASSWORD_HASH_ROUNDS = int(os.environ.get('PASSWORD_HASH_ROUNDS', 260000))
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', 2))
+PASSWORD_QUEUE_SIZE = int(os.environ.get('PASSWORD_QUEUE_SIZE', 32))
+HASH_PREFIX = 'pbkdf2:'
+
+
+def hash_method(rounds=None):
+    return 'pbkdf2:sha256:%d' % (rounds or PASSWORD_HASH_ROUNDS)
+
+
+def hash_password(password, rounds=None):
+    return generate_password_hash(password, method=hash_method(rounds))
+
+
+def needs_rehash(stored):
+    return stored.split('$', 1)[0] != hash_method()
+
+
+def check_password(stored, password):
+    if not stored.startswith(HASH_PREFIX):
+        # plaintext row from before hashing
+        return hmac.compare_digest(stored.encode('utf-8'), password.encode('utf-8'))
+    return check_password_hash(stored, password)
+
+
+class PasswordHasher:
+
+    def __init__(self, workers=PASSWORD_WORKERS, queue_size=PASSWORD_QUEUE_SIZE):
+        self.workers = workers
+        # running + waiting checks; past this logins are refused instead of piling up
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.executor = None
+        self.lock = threading.Lock()
+        self.dummy_hash = None
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password')
+            return self.executor
+
+    def _call(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            raise APIException('Too many logins in progress, try again later', 503)
+        try:
+            return self._get_executor().submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self._call(hash_password, password)
+
+    def verify(self, stored, password):
+        # returns (matches, new hash to store or None)
+        def run():
+            if not check_password(stored, password):
+                return False, None
+            return True, hash_password(password) if needs_rehash(stored) else None
+        return self._call(run)
+
+    def verify_missing(self, password):
+        # same work as a real check, so response times don't tell which emails exist
+        if self.dummy_hash is None:
+            self.dummy_hash = hash_password('')
+        self.verify(self.dummy_hash, password)
+        return False, None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,313 @@
+"""
+On demand profiling of single requests in production.
+
+A request is profiled when it carries a valid X-Profile header, or at random
+with probability PROFILE_SAMPLE_RATE (0, the default, turns that off). With
+PROFILE_ENDPOINTS set (comma separated, e.g.
+"api.get_all_files,api.handle_single_user") only those endpoints are.
+
+The header is <expires>.<signature>, an HMAC-SHA256 of the unix time
+<expires> with PROFILE_SECRET; without a secret the header is ignored.
+`flask profile token --minutes 2` prints one. A token is not bound to a
+request: anyone who sees it (logs, a shared shell history) can profile
+requests with it until it expires, so keep them short lived:
+
+    $ curl -H "X-Profile: $(flask profile token)" -H "X-Profile-Mode: cprofile" .../files
+
+Modes (X-Profile-Mode, PROFILE_MODE for sampled requests):
+    sample    default: a background thread records the stack of the request
+              thread every PROFILE_INTERVAL ms; the handler itself runs
+              untouched. Writes <id>.folded, collapsed stacks for
+              flamegraph.pl, speedscope or inferno
+    cprofile  every call is traced, exact counts but slower. Writes
+              <id>.pstats for pstats, snakeviz or flameprof
+
+Time is split into phases by the code it was spent in: sqlalchemy (query
+building, the pool, the driver), serialize (serialize() methods and JSON
+encoding), upload (uploads.py and the cloudinary package) and app for the
+rest. In a .folded file every stack starts with its phase, so each one is a
+block of the flamegraph. The phases are added to the response's
+Server-Timing header (estimated from the samples, or from the self time of
+each function with cprofile) together with the X-Profile-Id that names the
+files in PROFILE_DIR. At most PROFILE_MAX_ACTIVE requests per worker are
+profiled at the same time, and one with cprofile. PROFILE_DIR keeps the
+newest PROFILE_MAX_FILES files, older ones are removed as new ones are written.
+"""
+import os
+import re
+import sys
+import time
+import hmac
+import uuid
+import random
+import hashlib
+import cProfile
+import threading
+from collections import Counter
+import click
+from flask import request, g, current_app
+from flask.cli import AppGroup
+
+PHASES = ('sqlalchemy', 'serialize', 'upload', 'app')
+PROFILE_EXTENSIONS = ('.folded', '.pstats')
+# innermost match wins, so a lazy load inside serialize() counts as sqlalchemy;
+# plain attribute access (orm/attributes.py) doesn't count as the database
+_SKIPPED = ('sqlalchemy/orm/attributes.py',)
+_PATH_PHASES = (
+    ('sqlalchemy/', 'sqlalchemy'), ('psycopg2', 'sqlalchemy'), ('mysql/connector', 'sqlalchemy'),
+    ('MySQLdb', 'sqlalchemy'), ('sqlite3/', 'sqlalchemy'),
+    ('/json/', 'serialize'), ('orjson', 'serialize'), ('/encoding.py', 'serialize'),
+    ('cloudinary/', 'upload'), ('/uploads.py', 'upload')
+)
+# what comes before the path inside site-packages, the standard library or the app
+_PATH_PREFIX = re.compile(r'^.*/(site-packages|lib/python[0-9.]+|src)/')
+_SERIALIZE_FUNCTIONS = ('serialize', 'serialize_fields')
+
+
+def code_phase(filename, function):
+    if function in _SERIALIZE_FUNCTIONS:
+        return 'serialize'
+    if filename.endswith(_SKIPPED):
+        return None
+    for part, phase in _PATH_PHASES:
+        if part in filename:
+            return phase
+    return None
+
+
+def _frame_name(code):
+    # a short name that is the same on every machine
+    path = _PATH_PREFIX.sub('', code.co_filename.replace(os.sep, '/'))
+    return '%s (%s:%d)' % (code.co_name, path, code.co_firstlineno)
+
+
+def collapse(frame):
+    # (phase, "outer;...;inner") of a live frame
+    names = []
+    phase = None
+    while frame is not None:
+        code = frame.f_code
+        if phase is None:
+            phase = code_phase(code.co_filename, code.co_name)
+        names.append(_frame_name(code))
+        frame = frame.f_back
+    names.reverse()
+    return phase or 'app', ';'.join(names)
+
+
+class Sampler:
+    # one thread per worker, samples every thread with a profile in progress
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.profiles = {}  # thread id -> Counter of stacks
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, thread_id):
+        stacks = Counter()
+        with self.lock:
+            self.profiles[thread_id] = stacks
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self.thread.start()
+        return stacks
+
+    def stop(self, thread_id):
+        with self.lock:
+            self.profiles.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.profiles:
+                    self.thread = None
+                    return
+                # under the lock: a stopped profile gets no more samples
+                frames = sys._current_frames()
+                for thread_id, stacks in self.profiles.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse(frame)] += 1
+
+
+class RequestProfile:
+
+    def __init__(self, profiler, mode, endpoint):
+        self.profiler = profiler
+        self.mode = mode
+        self.id = '%s-%s-%s' % (time.strftime('%Y%m%dT%H%M%S'), endpoint or 'unmatched', uuid.uuid4().hex[:8])
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.phases = None
+        if mode == 'cprofile':
+            self.stats = cProfile.Profile()
+            self.stats.enable()
+        else:
+            self.stacks = profiler.sampler.start(self.thread_id)
+
+    def finish(self):
+        if self.elapsed is not None:
+            return
+        self.elapsed = time.perf_counter() - self.started
+        try:
+            if self.mode == 'cprofile':
+                self.stats.disable()
+                self.phases = self._cprofile_phases()
+                self.stats.dump_stats(os.path.join(self.profiler.directory, self.id + '.pstats'))
+            else:
+                self.profiler.sampler.stop(self.thread_id)
+                self.phases = self._sample_phases()
+                with open(os.path.join(self.profiler.directory, self.id + '.folded'), 'w') as output:
+                    for (phase, stack), count in self.stacks.most_common():
+                        output.write('%s;%s %d\n' % (phase, stack, count))
+            self.profiler.prune()
+        finally:
+            self.profiler.release(self)
+
+    def _sample_phases(self):
+        # samples in each phase, scaled to the request's wall time
+        counts = Counter()
+        for (phase, _), count in self.stacks.items():
+            counts[phase] += count
+        total = sum(counts.values())
+        return {x: self.elapsed * counts[x] / total if total else 0.0 for x in PHASES}
+
+    def _cprofile_phases(self):
+        self.stats.create_stats()
+        times = Counter()
+        for (filename, _, function), (_, _, own_time, _, _) in self.stats.stats.items():
+            times[code_phase(filename, function) or 'app'] += own_time
+        return {x: times[x] for x in PHASES}
+
+    def server_timing(self):
+        return ', '.join('profile-%s;dur=%.2f' % (x, self.phases[x] * 1000) for x in PHASES)
+
+
+class Profiler:
+
+    def __init__(self, config):
+        self.secret = config['PROFILE_SECRET']
+        self.sample_rate = float(config['PROFILE_SAMPLE_RATE'])
+        self.endpoints = set(x.strip() for x in config['PROFILE_ENDPOINTS'].split(',') if x.strip())
+        self.mode = config['PROFILE_MODE']
+        self.directory = config['PROFILE_DIR']
+        self.max_files = int(config['PROFILE_MAX_FILES'])
+        self.sampler = Sampler(float(config['PROFILE_INTERVAL']) / 1000)
+        # requests in profiles, and the single cProfile (one tracer per process on newer Pythons)
+        self.slots = threading.BoundedSemaphore(int(config['PROFILE_MAX_ACTIVE']))
+        self.cprofile = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def prune(self):
+        # oldest first past max_files; other workers prune the same directory
+        entries = [x for x in os.scandir(self.directory) if x.name.endswith(PROFILE_EXTENSIONS)]
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=lambda x: x.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def token(self, expires):
+        signature = hmac.new(self.secret.encode('utf-8'), str(expires).encode('utf-8'), hashlib.sha256).hexdigest()
+        return '%d.%s' % (expires, signature)
+
+    def valid_token(self, value):
+        if not self.secret or not value:
+            return False
+        expires, _, _ = value.partition('.')
+        if not expires.isdigit() or int(expires) < time.time():
+            return False
+        return hmac.compare_digest(self.token(int(expires)), value)
+
+    def wanted(self):
+        if self.endpoints and request.endpoint not in self.endpoints:
+            return None
+        header = request.headers.get('X-Profile')
+        if header is not None:
+            if not self.valid_token(header):
+                return None
+            return request.headers.get('X-Profile-Mode', self.mode)
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.mode
+        return None
+
+    def begin(self):
+        mode = self.wanted()
+        if mode not in ('sample', 'cprofile'):
+            return None
+        # skip rather than wait: profiling must never queue requests
+        if not self.slots.acquire(blocking=False):
+            return None
+        if mode == 'cprofile' and not self.cprofile.acquire(blocking=False):
+            mode = 'sample'
+        return RequestProfile(self, mode, request.endpoint)
+
+    def release(self, profile):
+        if profile.mode == 'cprofile':
+            self.cprofile.release()
+        self.slots.release()
+
+
+def before_request():
+    profile = current_app.extensions['profiler'].begin()
+    if profile is not None:
+        g.profile = profile
+
+
+def after_request(response):
+    profile = g.get('profile')
+    if profile is None:
+        return response
+    response.headers['X-Profile-Id'] = profile.id
+    if response.is_streamed:
+        # the handler's work goes on while the body is sent
+        response.call_on_close(profile.finish)
+        return response
+    profile.finish()
+    timing = profile.server_timing()
+    response.headers['Server-Timing'] = (response.headers['Server-Timing'] + ', ' + timing
+                                         if 'Server-Timing' in response.headers else timing)
+    current_app.logger.info('profile %s %.1fms %s', profile.id, profile.elapsed * 1000, timing)
+    return response
+
+
+def teardown_request(exc):
+    # unhandled errors skip after_request
+    profile = g.pop('profile', None)
+    if profile is not None and exc is not None:
+        profile.finish()
+
+
+profile_cli = AppGroup('profile', help='Request profiling.')
+
+
+@profile_cli.command('token')
+@click.option('--minutes', type=int, default=2, show_default=True)
+def token_command(minutes):
+    """Print an X-Profile header value."""
+    profiler = current_app.extensions['profiler']
+    if not profiler.secret:
+        raise click.ClickException('PROFILE_SECRET is not set')
+    click.echo(profiler.token(int(time.time()) + minutes * 60))
+
+
+def setup_profiling(app):
+    app.config.setdefault('PROFILE_SECRET', os.environ.get('PROFILE_SECRET', ''))
+    app.config.setdefault('PROFILE_SAMPLE_RATE', os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    app.config.setdefault('PROFILE_ENDPOINTS', os.environ.get('PROFILE_ENDPOINTS', ''))
+    app.config.setdefault('PROFILE_MODE', os.environ.get('PROFILE_MODE', 'sample'))
+    app.config.setdefault('PROFILE_INTERVAL', os.environ.get('PROFILE_INTERVAL', 5))
+    app.config.setdefault('PROFILE_MAX_ACTIVE', os.environ.get('PROFILE_MAX_ACTIVE', 2))
+    app.config.setdefault('PROFILE_DIR', os.environ.get('PROFILE_DIR', '/tmp/jamfree-profiles'))
+    app.config.setdefault('PROFILE_MAX_FILES', os.environ.get('PROFILE_MAX_FILES', 200))
+    app.extensions['profiler'] = Profiler(app.config)
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    app.cli.add_command(profile_cli)
@@ -0,0 +1,506 @@
+"""
+The API endpoints, registered on the app by create_app() in main.py
+"""
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_simple import create_jwt
+from utils import APIException, generate_sitemap, get_int_arg, keyset_paginate, stream_query, make_etag, not_modified, set_validators, read_records, get_fields # APIException es un method
+from sqlalchemy.orm import load_only
+from models import db, User, Files, UploadJob, field_columns, serialize_fields
+from search import search_files
+from catalog import changes_since, latest_version, file_version, facet_counts
+from cache import file_cache
+from uploads import upload_queue
+from matching import match_index, student_profile
+from identity import identity_required, current_identity
+from passwords import password_hasher
+from database import use_replica, read_from_replica
+import bulk
+
+api = Blueprint('api', __name__)
+
+
+# Handle/serialize errors like a JSON object
+@api.app_errorhandler(APIException)
+def handle_invalid_usage(error):
+    return jsonify(error.to_dict()), error.status_code
+
+# generate sitemap with all your endpoints
+@api.route('/')
+def sitemap():
+    return generate_sitemap(current_app)
+
+@api.route('/user', methods=['GET'])
+def handle_hello():
+
+    response_body = {
+        "msg": "Hello, this is your GET /user response "
+    }
+
+    return jsonify(response_body), 200
+
+# Create a new user 
+@api.route('/user', methods=['POST'])
+def create_user():
+    try:
+        body = request.get_json()
+        print(request)
+        if body is None:
+            raise APIException("You need to specify the request body as a json object", 400)
+        # Validations
+        if 'email' not in body:
+            raise APIException("You need to specify an email", 400)
+        if 'first_name' not in body:
+            raise APIException("You need to specify a first name", 400)
+        if 'last_name' not in body:
+            raise APIException("You need to specify a last name", 400)
+        if 'password' not in body:
+            raise APIException("You need to specify a password", 400)
+        if 'account_type' not in body:
+            raise APIException("You need to specify account type", 400)
+        if 'language' not in body:
+            raise APIException("You need to specify your language", 400)
+        if 'customer_id' not in body:
+            raise APIException("You need to specify your customer id", 400)
+        # check if this email already exists
+        user_exists = User.query.filter_by(email=body['email']).first()
+        # Exception when user exists
+        if user_exists is not None: 
+            raise APIException("email is in use", 400)
+        user = User(first_name=body['first_name'], last_name=body['last_name'], email=body['email'], password=password_hasher.hash(body['password']), account_type=body['account_type'], language=body['language'], customer_id=body["customer_id"])
+        db.session.add(user)
+        db.session.commit()
+        return jsonify("Success", 200)
+    except Exception as e:
+        return jsonify(e.__dict__)
+
+# ?include=files,teacher,student adds those related rows to each user
+def get_include(args):
+    include = tuple(x for x in args.get('include', '').split(',') if x)
+    for name in include:
+        if name not in User.INCLUDES:
+            raise APIException("include must be some of: " + ", ".join(User.INCLUDES), 400)
+    return include
+
+def user_validators(user, include, fields):
+    fields = ','.join(fields or ())
+    if not include:
+        return make_etag('user', user.id, user.updated_at, fields), user.updated_at
+    # the related rows are part of the body, and removing one of them doesn't
+    # move any updated_at, so these responses only get an ETag
+    parts = ['user', user.id, user.updated_at, fields, ','.join(include)]
+    if 'files' in include:
+        parts.extend((x.id, x.updated_at) for x in user.files)
+    if 'teacher' in include and user.teacher is not None:
+        parts.append(sorted(user.teacher.serialize().items()))
+    if 'student' in include and user.student is not None:
+        parts.append(sorted(user.student.serialize().items()))
+    return make_etag(*parts), None
+
+# Single Users
+@api.route('/user/<int:user_id>', methods=['POST', 'GET'])
+@identity_required
+def handle_single_user(user_id):
+    include, fields, options = (), None, []
+    if request.method == 'GET':
+        include = get_include(request.args)
+        fields = get_fields(request.args, User)
+        options = User.include_options(include)
+        if fields:
+            options.append(load_only(*field_columns(User, fields), User.updated_at))
+    target_user = User.query.options(*options).get(user_id)
+    
+    if request.method == 'POST':
+        try:
+            body=request.form
+            # Get all form data fields
+            first_name = request.form["first_name"]
+            last_name = request.form["last_name"]
+            language = request.form["language"]
+            instrument = request.form["instrument"]
+            level = request.form["level"]
+            description = request.form["description"]
+            profile_picture = request.files.get("profile_picture")
+            # username = request.form["username"]
+
+            print(request.form["first_name"])
+            
+            # Modify an user
+            if target_user is None:
+                raise APIException('User not found', 404)
+            if "first_name" in body:
+                target_user.first_name = first_name
+            if "last_name" in body:
+                target_user.last_name = last_name
+            if "language" in body:
+                target_user.language = language
+                
+
+            # if "username" in body:
+            #     username_exists = User.query.filter_by(username=username).first()
+            #     if username_exists is not None: 
+            #         raise APIException("username is in use", 400)
+            #     target_user.username = username
+
+            # check if this username already exists
+            # username_exists = User.query.filter_by(username=body['username']).first()
+            # Exception when user exists
+            # if username_exists is not None: 
+            #     raise APIException("username is in use", 400)
+            # if "username" in body:
+            #     username_exists = User.query.filter_by(username=username).first()
+            #     if username_exists is not None: 
+            #         raise APIException("username is in use", 400)
+            #     target_user.username = username
+            
+            if "instrument" in body:
+                target_user.instrument = instrument  
+            if "level" in body:
+                target_user.level = level
+            if "description" in body:
+                target_user.description = description  
+
+            # if "username" in body:
+            #     username_exists = User.query.filter_by(username=username).first()
+            #     if username_exists is not None: 
+            #         raise APIException("username is in use", 400)
+            #     target_user.username = username
+
+            db.session.commit()
+
+            if profile_picture is not None:
+                print('picture attached')
+                # upload to cloudinary in the background, the client polls /upload/<id>
+                # unless the same picture was already uploaded and the job is done
+                job = upload_queue.submit(current_app._get_current_object(), target_user, profile_picture)
+                return jsonify(job.serialize()), 200 if job.status == 'done' else 202
+            
+            # return jsonify(target_user.serialize()),200
+            return jsonify("Success", 200)
+        except APIException:
+            raise
+        except Exception as e:
+            return jsonify(e.__dict__)  
+    
+    # Get an user
+    if request.method == 'GET':
+        if target_user is None:
+            raise APIException('User not found', 404)
+        etag, last_modified = user_validators(target_user, include, fields)
+        response = not_modified(etag, last_modified)
+        if response is not None:
+            return response
+        return set_validators(jsonify(target_user.serialize(include, fields), 200), etag, last_modified)
+    return jsonify("Invalid Method", 404)
+
+# Status of a profile picture upload
+@api.route('/upload/<int:job_id>', methods=['GET'])
+@identity_required
+def get_upload_job(job_id):
+    job = UploadJob.query.get(job_id)
+    if job is None:
+        raise APIException('Upload not found', 404)
+    return jsonify(job.serialize()), 200
+
+# Delete user
+@api.route('/user/<int:user_id>', methods=['DELETE'])
+@identity_required
+def delete_user(user_id):
+    target_user = User.query.get(user_id)
+    if target_user is None:
+        raise APIException('User not found', 404)
+    db.session.delete(target_user)
+    db.session.commit()
+    return jsonify("Success", 200)
+
+MATCH_LIMIT = 10
+MATCH_MAX_LIMIT = 100
+
+# Teachers for a student, best first
+# ?student_id= is the user id of the student, the caller by default
+# ?limit= how many teachers to return
+@api.route('/teachers/match', methods=['GET'])
+@identity_required
+def match_teachers():
+    student_id = get_int_arg(request.args, 'student_id', current_identity().id)
+    limit = get_int_arg(request.args, 'limit', MATCH_LIMIT, minimum=1, maximum=MATCH_MAX_LIMIT)
+    student = student_profile(student_id)
+    if student is None:
+        raise APIException('Student not found', 404)
+    response_body = {
+        "student_id": student_id,
+        "instrument": student.instrument,
+        "language": student.language,
+        "level": student.level,
+        "teachers": match_index.match(student.instrument, student.language, student.level, limit)
+    }
+    return jsonify(response_body), 200
+
+
+# Get all users
+# ?stream=json|ndjson streams every user in batches instead of building the list
+# ?include=files,teacher,student loads the related rows in a fixed number of queries
+# ?fields=id,first_name,... selects and returns only those columns
+@api.route('/users', methods=['GET'])
+@use_replica
+def get_all_users():
+    include = get_include(request.args)
+    fields = get_fields(request.args, User)
+    query = User.query.options(*User.include_options(include))
+    if fields and include:
+        query = query.options(load_only(*field_columns(User, fields)))
+    elif fields:
+        # plain rows with just these columns, no User objects are built
+        query = query.with_entities(*field_columns(User, fields))
+    def serialize(x):
+        if fields and not include:
+            return serialize_fields(User, x, fields)
+        return x.serialize(include, fields)
+    if 'stream' in request.args:
+        return stream_query(query.order_by(User.id), serialize, request.args['stream'])
+    users = query.all()
+    if users is None:
+        raise APIException('There are no users', 404)
+    all_users = list(map(serialize, users ))
+    return jsonify(all_users, 200)
+
+
+# Filter Files
+@api.route('/file/<int:file_id>', methods=['GET'])
+def get_file(file_id):
+    fields = get_fields(request.args, Files)
+    # only the full representation is cached, that is the key invalidation knows about.
+    # Cached responses are built from the primary, a lagging replica read would stick for CACHE_TTL
+    key = file_cache.file_key(file_id) if not fields else None
+    if key is None:
+        read_from_replica()
+    version = file_version(file_id) if key is not None else None
+    single_file = None
+    def validators():
+        nonlocal single_file
+        query = Files.query
+        if fields:
+            query = query.options(load_only(*field_columns(Files, fields), Files.updated_at))
+        single_file = query.get(file_id) # query to the db to get the file
+        if single_file is None:
+            raise APIException('File not found', 404)
+        return make_etag('file', file_id, single_file.updated_at, ','.join(fields or ())), single_file.updated_at
+    def build():
+        return [single_file.serialize(fields), 200] # Getting the file
+    return file_cache.json_response(key, build, validators, version)
+
+
+def files_validators(version):
+    # every insert, update or delete appends to the change log. No Last-Modified
+    # for the lists: a delete does not move max(updated_at)
+    return lambda: (make_etag('files', version, request.query_string), None)
+
+
+FILES_PAGE_SIZE = 50
+FILES_MAX_PAGE_SIZE = 500
+
+# Get all files
+# filters: ?instrument=&level=&language=&typeFile=
+# pages: ?limit=&cursor= (cursor is the next_cursor of the previous page)
+# ?stream=json|ndjson streams every matching file in batches
+# ?fields=id,title,... selects and returns only those columns
+@api.route('/files', methods=['GET'])
+# @jwt_required
+def get_all_files():
+    fields = get_fields(request.args, Files)
+    query = Files.filter_by_args(request.args)
+    if fields:
+        # plain rows with just these columns, no Files objects are built
+        query = query.with_entities(*field_columns(Files, fields))
+    def serialize(x):
+        return serialize_fields(Files, x, fields) if fields else x.serialize()
+    if 'stream' in request.args:
+        # not cached, so the replica can serve it
+        read_from_replica()
+        return stream_query(query.order_by(Files.id), serialize, request.args['stream'])
+    version = latest_version()
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        def build():
+            files = query.all() # Get all files
+            if files is None:
+                raise APIException('There are no files', 404)
+            all_files = list(map(serialize, files )) # el x es el element, param files
+            return [all_files, 200]
+        return file_cache.json_response(file_cache.files_key(request.args), build, files_validators(version), version)
+
+    limit = get_int_arg(request.args, 'limit', FILES_PAGE_SIZE, minimum=1, maximum=FILES_MAX_PAGE_SIZE)
+    cursor = get_int_arg(request.args, 'cursor')
+    def build_page():
+        files, next_cursor = keyset_paginate(query, Files.id, cursor, limit)
+        response_body = {
+            "files": list(map(serialize, files)),
+            "next_cursor": next_cursor
+        }
+        return [response_body, 200]
+    return file_cache.json_response(file_cache.files_key(request.args), build_page, files_validators(version), version)
+
+
+FILES_CHANGES_PAGE_SIZE = 1000
+FILES_CHANGES_MAX_PAGE_SIZE = 5000
+
+# Files created, changed or deleted since a sync token
+# ?since= is the next_token of the previous call, 0 (the default) sends the whole catalog
+# keep calling with the new token while has_more is true
+@api.route('/files/changes', methods=['GET'])
+@use_replica
+def get_file_changes():
+    since = get_int_arg(request.args, 'since', 0, minimum=0)
+    limit = get_int_arg(request.args, 'limit', FILES_CHANGES_PAGE_SIZE, minimum=1, maximum=FILES_CHANGES_MAX_PAGE_SIZE)
+    files, deleted, next_token, has_more = changes_since(since, limit)
+    if next_token == since and since > latest_version():
+        # a token from another database, or from before a restore
+        raise APIException("Unknown sync token, sync again from since=0", 410)
+    response_body = {
+        "files": list(map(lambda x: x.serialize(), files)),
+        "deleted": deleted,
+        "next_token": next_token,
+        "has_more": has_more
+    }
+    return jsonify(response_body), 200
+
+
+# Number of files per instrument, level, language and typeFile
+# filters: same as /files; each facet is counted under the filters on the others
+@api.route('/files/facets', methods=['GET'])
+@use_replica
+def get_file_facets():
+    etag = make_etag('facets', latest_version(), request.query_string)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    return set_validators(jsonify(facet_counts(request.args)), etag)
+
+
+# Hit/miss counters of the file catalog cache
+@api.route('/files/cache', methods=['GET'])
+@identity_required
+def get_files_cache_stats():
+    return jsonify(file_cache.stats()), 200
+
+
+# Search files
+# ?q= words to look for, ranked by title first and then the other columns
+@api.route('/files/search', methods=['GET'])
+@use_replica
+def search_all_files():
+    q = request.args.get('q', '').strip()
+    if not q:
+        raise APIException("You need to specify a search query", 400)
+    limit = get_int_arg(request.args, 'limit', 20, minimum=1, maximum=100)
+    files = search_files(q, limit)
+    all_files = list(map(lambda x: x.serialize(), files))
+    return jsonify(all_files, 200)
+
+
+# Delete file
+@api.route('/file/<int:file_id>', methods=['DELETE'])
+def delete_file(file_id):
+    target_file = Files.query.get(file_id)
+    if target_file is None:
+        raise APIException('File not found', 404)
+    db.session.delete(target_file)                  # Delete method
+    db.session.commit()                             # save changes
+    return jsonify("Success", 200)
+
+
+# Create File
+@api.route('/file', methods=['POST'])
+def create_file(): #encapsular accion
+    body = request.get_json() # encapsula el paquete enviado del postman, recibe json y lo convierte al lenguaje del diccionario
+    print(body)
+    single_file = Files(instrument=body['instrument'], type_file=body['typeFile'], level=body['level'], language=body['language'], url=body['url'], user_id=body['userId'], title=body['title'])
+    db.session.add(single_file) # adding user
+    db.session.commit() # commiting what we add
+    return jsonify(body, 200)
+
+# Edit File
+@api.route('/file/<int:file_id>', methods=['PUT'])
+def edit_file(file_id):
+    body = request.get_json()
+    single_file = Files.query.get(file_id) # get a unique file
+    if single_file is None: # handling error
+        raise APIException('File not found', status_code = 404)
+    if "instrument" in body:
+        single_file.instrument = body['instrument']
+    if "typeFile" in body:
+        single_file.type_file = body['typeFile']
+    if "level" in body:
+        single_file.level = body['level']  
+    if "language" in body:
+        single_file.language = body['language']
+    if "url" in body:
+        single_file.url = body['url']
+    if "title" in body:
+        single_file.title = body['title']
+    db.session.commit()
+    return jsonify(body, 200)
+
+# Bulk create, update and delete files
+# body: json array or ndjson (Content-Type: application/x-ndjson)
+# POST items are like the body of POST /file, PUT items also need the "id",
+# DELETE items are file ids. Each item gets its own result
+@api.route('/files/bulk', methods=['POST', 'PUT', 'DELETE'])
+def bulk_files():
+    records = read_records(request)
+    if request.method == 'POST':
+        summary, ids = bulk.create_files(records)
+    elif request.method == 'PUT':
+        summary, ids = bulk.update_files(records)
+    else:
+        summary, ids = bulk.delete_files(records)
+    return jsonify(summary), 200
+
+    
+
+    
+# Login
+# # Provide a method to create access tokens. The create_jwt()
+# # function is used to actually generate the token
+@api.route('/login', methods=['POST'])
+def login():
+    if not request.is_json:
+        return jsonify({"msg": "Missing JSON in request"}), 400
+
+    params = request.get_json()
+    email = params.get('email', None)
+    password = params.get('password', None)
+
+    
+    login_user = User.query.filter_by(email= email).first()
+    # print("login_user:", login_user)
+    
+
+    if not email:
+        return jsonify({"msg": "Missing email parameter"}), 400
+    if not password:
+        return jsonify({"msg": "Missing password parameter"}), 400
+
+    if login_user is None:
+        matches, new_hash = password_hasher.verify_missing(password)
+    else:
+        matches, new_hash = password_hasher.verify(login_user.password, password)
+    if not matches:
+        return jsonify({"msg": "Bad email or password"}), 401
+    if new_hash is not None:
+        # plaintext or older settings, store it with the current ones
+        login_user.password = new_hash
+        db.session.commit()
+    
+# Identity can be any data that is json serializable
+# jwt_data in identity.py turns the user into the sub (email), uid and ver claims
+    ret = {
+        'jwt': create_jwt(identity=login_user),
+        'userId': login_user.id
+    }
+    return jsonify(ret), 200
+
+# # # Protected routes
+# @app.route('/main', methods=['GET'])
+# @jwt_required
+# def protected():
+#     # Access the identity of the current user with get_jwt_identity
+#     return jsonify({'hello_from': get_jwt_identity()}), 200
@@ -0,0 +1,94 @@
+"""
+Full text search over the Files catalog.
+
+SQLite uses an FTS5 table (files_fts) kept in sync by triggers on files,
+Postgres uses a generated tsvector column (files.search_vector) with a GIN index.
+Both are updated by the database in the same statement that writes the row, so
+create_file, edit_file, delete_file and any other writer can not leave it stale.
+Other databases fall back to a LIKE scan on the title.
+"""
+import re
+from sqlalchemy import event, DDL, text
+from models import db, Files
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE files_fts USING fts5(
+        title, instrument, level, language, type_file,
+        content='files', content_rowid='id'
+    )""",
+    """CREATE TRIGGER files_fts_ai AFTER INSERT ON files BEGIN
+        INSERT INTO files_fts(rowid, title, instrument, level, language, type_file)
+        VALUES (new.id, new.title, new.instrument, new.level, new.language, new.type_file);
+    END""",
+    """CREATE TRIGGER files_fts_ad AFTER DELETE ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, title, instrument, level, language, type_file)
+        VALUES ('delete', old.id, old.title, old.instrument, old.level, old.language, old.type_file);
+    END""",
+    """CREATE TRIGGER files_fts_au AFTER UPDATE ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, title, instrument, level, language, type_file)
+        VALUES ('delete', old.id, old.title, old.instrument, old.level, old.language, old.type_file);
+        INSERT INTO files_fts(rowid, title, instrument, level, language, type_file)
+        VALUES (new.id, new.title, new.instrument, new.level, new.language, new.type_file);
+    END""",
+]
+
+POSTGRES_DDL = [
+    """ALTER TABLE files ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple',
+            coalesce(instrument, '') || ' ' || coalesce(level, '') || ' ' ||
+            coalesce(language, '') || ' ' || coalesce(type_file, '')), 'B')
+    ) STORED""",
+    "CREATE INDEX ix_files_search_vector ON files USING GIN (search_vector)",
+]
+
+# bm25() weights, in the column order of files_fts: the title ranks highest
+SQLITE_SEARCH = """
+    SELECT rowid AS id FROM files_fts
+    WHERE files_fts MATCH :query
+    ORDER BY bm25(files_fts, 10.0, 1.0, 1.0, 1.0, 1.0)
+    LIMIT :limit
+"""
+
+POSTGRES_SEARCH = """
+    SELECT id FROM files
+    WHERE search_vector @@ to_tsquery('simple', :query)
+    ORDER BY ts_rank(search_vector, to_tsquery('simple', :query)) DESC, id
+    LIMIT :limit
+"""
+
+for statement in SQLITE_DDL:
+    event.listen(Files.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRES_DDL:
+    event.listen(Files.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+event.listen(Files.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS files_fts").execute_if(dialect='sqlite'))
+
+
+def tokenize(q):
+    # only word characters reach the query so user input can't inject operators
+    return re.findall(r'\w+', q or '', re.UNICODE)
+
+
+def search_files(q, limit=20):
+    tokens = tokenize(q)
+    if not tokens:
+        return []
+
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        query = ' '.join('"%s"*' % token for token in tokens)
+        ids = [row.id for row in db.session.execute(text(SQLITE_SEARCH), {"query": query, "limit": limit})]
+    elif dialect == 'postgresql':
+        query = ' & '.join('%s:*' % token for token in tokens)
+        ids = [row.id for row in db.session.execute(text(POSTGRES_SEARCH), {"query": query, "limit": limit})]
+    else:
+        query = Files.query
+        for token in tokens:
+            query = query.filter(Files.title.ilike('%' + token + '%'))
+        return query.order_by(Files.id).limit(limit).all()
+
+    if not ids:
+        return []
+    # keep the rank order of the index
+    files = {x.id: x for x in Files.query.filter(Files.id.in_(ids))}
+    return [files[x] for x in ids if x in files]
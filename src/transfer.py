@@ -0,0 +1,246 @@
+"""
+Bulk export and import of tables as CSV or NDJSON, for moving data between
+environments:
+
+    $ flask data export users users.ndjson
+    $ flask data export files files.csv
+    $ flask data import users users.ndjson
+    $ flask data import files files.csv
+
+The format comes from the file extension (.csv, anything else is NDJSON) or
+--format; '-' is stdout/stdin. Rows are written and read in batches, so memory
+does not grow with the table. On Postgres CSV goes through COPY; everything
+else is streamed through a server side cursor on export and executemany
+INSERTs on import. Progress and rows/s go to stderr.
+
+Exports are raw rows, column names as in the database, passwords included.
+Imports insert into the existing tables in one transaction: load users
+before teachers, students and files. In CSV an empty value of a nullable
+column is NULL.
+"""
+import csv
+import json
+import time
+from datetime import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, func, text
+from models import db, User, Teacher, Student, Files
+from catalog import recount_facets, record_file_changes
+
+TABLES = {
+    "users": User.__table__,
+    "teachers": Teacher.__table__,
+    "students": Student.__table__,
+    "files": Files.__table__
+}
+FORMATS = ('csv', 'ndjson')
+BATCH_SIZE = 5000
+
+data_cli = AppGroup('data', help='Export and import tables as CSV or NDJSON.')
+
+
+class Progress:
+
+    def __init__(self, label, every=1.0):
+        self.label = label
+        self.every = every
+        self.rows = 0
+        self.started = self.reported = time.perf_counter()
+
+    def _echo(self, final=False):
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed else 0
+        click.echo('%s: %d rows%s, %d rows/s' % (
+            self.label, self.rows, ' in %.1fs' % elapsed if final else '', rate), err=True)
+
+    def add(self, rows):
+        self.rows += rows
+        if time.perf_counter() - self.reported >= self.every:
+            self.reported = time.perf_counter()
+            self._echo()
+
+    def done(self):
+        self._echo(final=True)
+
+
+def _format(fmt, name):
+    if fmt is not None:
+        return fmt
+    return 'csv' if name.endswith('.csv') else 'ndjson'
+
+
+def _copy_supported(connection):
+    return connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2'
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _decoders(table, columns):
+    # CSV values are all strings, NDJSON ones may be too (dates always are)
+    decoders = {}
+    for name in columns:
+        column = table.c[name]
+        python_type = column.type.python_type
+
+        def decode(value, python_type=python_type, nullable=column.nullable):
+            if value is None or (value == '' and nullable):
+                return None
+            if python_type is datetime:
+                return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+            if python_type is int and not isinstance(value, int):
+                return int(value)
+            return value
+        decoders[name] = decode
+    return decoders
+
+
+def _check_columns(table, columns):
+    unknown = [x for x in columns if x not in table.c]
+    if unknown:
+        raise click.UsageError('unknown columns for %s: %s' % (table.name, ', '.join(unknown)))
+
+
+def export_table(table, out, fmt, batch_size=BATCH_SIZE):
+    progress = Progress('export %s' % table.name)
+    connection = db.session.connection()
+    if fmt == 'csv' and _copy_supported(connection):
+        cursor = connection.connection.cursor()
+        preparer = connection.dialect.identifier_preparer
+        # the model's columns, not *: generated ones (files.search_vector) would not import back
+        columns = ', '.join(preparer.format_column(x) for x in table.columns)
+        cursor.copy_expert('COPY (SELECT %s FROM %s ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER true)'
+                           % (columns, preparer.format_table(table)), out)
+        progress.add(cursor.rowcount)
+        progress.done()
+        return progress.rows
+
+    columns = [x.name for x in table.columns]
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+    # one statement, so the export is a consistent snapshot, read in batches
+    result = connection.execution_options(stream_results=True).execute(select(table).order_by(table.c.id))
+    for rows in result.partitions(batch_size):
+        if fmt == 'csv':
+            writer.writerows([_encode(x) for x in row] for row in rows)
+        else:
+            out.write(''.join(json.dumps(dict(zip(columns, map(_encode, row)))) + '\n' for row in rows))
+        progress.add(len(rows))
+    progress.done()
+    return progress.rows
+
+
+def _read_batches(table, source, fmt, batch_size):
+    if fmt == 'csv':
+        reader = csv.reader(source)
+        columns = next(reader, None) or []
+        records = (dict(zip(columns, x)) for x in reader)
+    else:
+        records = (json.loads(x) for x in source if x.strip())
+        first = next(records, None)
+        if first is None:
+            return
+        columns = list(first)
+        records = _prepend(first, records)
+    _check_columns(table, columns)
+    decoders = _decoders(table, columns)
+    batch = []
+    for record in records:
+        # every row of an executemany needs the same keys
+        batch.append({x: decoders[x](record.get(x)) for x in columns})
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _prepend(first, records):
+    yield first
+    yield from records
+
+
+def _copied_ids(connection, table):
+    # COPY doesn't hand us the rows: the ones this transaction inserted
+    name = connection.dialect.identifier_preparer.format_table(table)
+    return [x[0] for x in connection.execute(text(
+        "SELECT id FROM %s WHERE xmin::text = (txid_current() %% 4294967296)::text ORDER BY id" % name))]
+
+
+def import_table(table, source, fmt, batch_size=BATCH_SIZE):
+    progress = Progress('import %s' % table.name)
+    connection = db.session.connection()
+    # rows without an id get one past the current maximum
+    last_id = connection.execute(select(func.max(table.c.id))).scalar() or 0
+    ids = []
+    copied = False
+    if fmt == 'csv' and _copy_supported(connection):
+        columns = next(csv.reader([source.readline()]), [])
+        _check_columns(table, columns)
+        preparer = connection.dialect.identifier_preparer
+        names = ', '.join(preparer.quote(x) for x in columns)
+        # empty values of NOT NULL columns are empty strings, like the executemany path
+        not_null = ', '.join(preparer.quote(x) for x in columns if not table.c[x].nullable)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv%s)' % (
+            preparer.format_table(table), names, ', FORCE_NOT_NULL (%s)' % not_null if not_null else ''), source)
+        progress.add(cursor.rowcount)
+        copied = True
+    else:
+        for batch in _read_batches(table, source, fmt, batch_size):
+            connection.execute(table.insert(), batch)
+            ids.extend(x['id'] for x in batch if x.get('id') is not None)
+            progress.add(len(batch))
+
+    if connection.dialect.name == 'postgresql':
+        # ids came from the file, move the sequence past them
+        name = connection.dialect.identifier_preparer.format_table(table)
+        connection.execute(text("SELECT setval(pg_get_serial_sequence(:table, 'id'), COALESCE(MAX(id), 1)) FROM %s" % name),
+                           {"table": name})
+    if table is Files.__table__:
+        # the rows went around the ORM: recount the facets and log the
+        # imported files, clients that are in sync only get those
+        if copied:
+            ids = _copied_ids(connection, table)
+        elif len(ids) < progress.rows:
+            ids.extend(x[0] for x in connection.execute(select(table.c.id).where(table.c.id > last_id)))
+        recount_facets(db.session)
+        record_file_changes(db.session, upserted=sorted(set(ids)))
+    db.session.commit()
+    progress.done()
+    return progress.rows
+
+
+@data_cli.command('export')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='default: from the file extension')
+@click.option('--batch-size', type=int, default=BATCH_SIZE, show_default=True)
+def export_command(table, output, fmt, batch_size):
+    """Write every row of TABLE to OUTPUT."""
+    export_table(TABLES[table], output, _format(fmt, output.name), batch_size)
+
+
+@data_cli.command('import')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='default: from the file extension')
+@click.option('--batch-size', type=int, default=BATCH_SIZE, show_default=True)
+def import_command(table, source, fmt, batch_size):
+    """Insert the rows in SOURCE into TABLE."""
+    try:
+        import_table(TABLES[table], source, _format(fmt, source.name), batch_size)
+    except click.UsageError:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        # the driver error, without the statement and its thousands of parameters
+        raise click.ClickException('import of %s failed, nothing was written: %s' % (table, getattr(e, 'orig', e)))
+
+
+def setup_commands(app):
+    app.cli.add_command(data_cli)
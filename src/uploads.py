@@ -0,0 +1,301 @@
+"""
+Background upload of profile pictures.
+
+The request only copies the picture to a temporary file and records an
+UploadJob; the transfer to the uploader runs on a small thread pool and sets
+User.profile_picture when it finishes. GET /upload/<job_id> reports progress.
+
+The bytes are hashed while they are copied, and a picture whose sha256 is
+already in MediaAsset is not uploaded again. New pictures are resized locally
+to PICTURE_MAX_SIZE and THUMBNAIL_SIZE (when Pillow is installed) and both
+variants are uploaded instead of the original.
+
+UPLOADER selects where pictures go:
+    cloudinary  default, configured with the CLOUDINARY_* variables
+    local       writes to UPLOAD_DIR, meant for tests and local runs
+"""
+import os
+import re
+import glob
+import uuid
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import IntegrityError
+from utils import APIException
+from models import db, User, UploadJob, MediaAsset
+
+_pillow = None
+
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))
+UPLOAD_QUEUE_SIZE = int(os.environ.get('UPLOAD_QUEUE_SIZE', 16))
+# most public ids the Cloudinary admin API deletes in one call
+DELETE_BATCH_SIZE = 100
+SPOOL_MAX_SIZE = 1024 * 1024
+# https://res.cloudinary.com/<cloud>/<resource type>/upload/[<transformations>/][v<version>/]<public id>
+CLOUDINARY_URL = re.compile(r'^https?://res\.cloudinary\.com/([^/]+)/(image|video|raw)/upload/'
+                            r'(?:[a-z]{1,3}_[^/]+/)*(?:v\d+/)?(.+)$')
+CHUNK_SIZE = 64 * 1024
+PICTURE_MAX_SIZE = int(os.environ.get('PICTURE_MAX_SIZE', 1024))
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 128))
+
+
+class CloudinaryUploader:
+
+    def __init__(self):
+        import cloudinary
+        import cloudinary.api
+        import cloudinary.uploader
+        cloudinary.config(
+            cloud_name = os.environ.get('CLOUDINARY_CLOUD_NAME'),
+            api_key = os.environ.get('CLOUDINARY_API_KEY'),
+            api_secret = os.environ.get('CLOUDINARY_API_SECRET')
+        )
+        self.cloudinary = cloudinary
+
+    def upload(self, fileobj, filename=None):
+        result = self.cloudinary.uploader.upload(
+            fileobj,
+            use_filename=True,  # use filename as public id on cloudinary
+            filename_override=filename
+        )
+        return {"secure_url": result['secure_url'], "public_id": result['public_id']}
+
+    def asset_id(self, url):
+        # (resource type, public id) of an url of this cloud, None for anything else
+        match = CLOUDINARY_URL.match(url or '')
+        if match is None or match.group(1) != self.cloudinary.config().cloud_name:
+            return None
+        resource_type, public_id = match.group(2), match.group(3)
+        if resource_type != 'raw':
+            # the extension only picks the delivery format
+            public_id = os.path.splitext(public_id)[0]
+        return resource_type, public_id
+
+    def delete_many(self, public_ids, resource_type='image'):
+        # returns the ids that are gone, missing ones included
+        gone = set()
+        for start in range(0, len(public_ids), DELETE_BATCH_SIZE):
+            result = self.cloudinary.api.delete_resources(public_ids[start:start + DELETE_BATCH_SIZE],
+                                                          resource_type=resource_type)
+            gone.update(x for x, status in result['deleted'].items() if status in ('deleted', 'not_found'))
+        return gone
+
+
+class LocalUploader:
+
+    def __init__(self, directory=None, base_url=None):
+        self.directory = directory or os.environ.get('UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'jamfree-uploads'))
+        self.base_url = base_url or os.environ.get('UPLOAD_BASE_URL', 'file://' + self.directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def upload(self, fileobj, filename=None):
+        extension = os.path.splitext(filename or '')[1]
+        public_id = uuid.uuid4().hex
+        with open(os.path.join(self.directory, public_id + extension), 'wb') as target:
+            shutil.copyfileobj(fileobj, target)
+        return {"secure_url": self.base_url + '/' + public_id + extension, "public_id": public_id}
+
+    def asset_id(self, url):
+        if not (url or '').startswith(self.base_url + '/'):
+            return None
+        return 'image', os.path.splitext(url[len(self.base_url) + 1:])[0]
+
+    def delete_many(self, public_ids, resource_type='image'):
+        for public_id in public_ids:
+            for path in glob.glob(os.path.join(self.directory, glob.escape(public_id) + '.*')):
+                os.remove(path)
+        return set(public_ids)
+
+
+UPLOADERS = {
+    'cloudinary': CloudinaryUploader,
+    'local': LocalUploader
+}
+
+_uploader = None
+
+def get_uploader():
+    # created on first use so boot and forked workers don't pay for it
+    global _uploader
+    if _uploader is None:
+        _uploader = UPLOADERS[os.environ.get('UPLOADER', 'cloudinary')]()
+    return _uploader
+
+def set_uploader(uploader):
+    global _uploader
+    _uploader = uploader
+
+
+def get_pillow():
+    # imported by the first upload instead of at boot; None without Pillow
+    global _pillow
+    if _pillow is None:
+        try:
+            from PIL import Image, ImageOps
+            _pillow = (Image, ImageOps)
+        except ImportError:
+            _pillow = ()
+    return _pillow or None
+
+
+def spool_and_hash(stream):
+    # single pass over the request stream: hash and keep a copy for the worker
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return spool, digest.hexdigest()
+
+def _encode(image, max_size, filename):
+    image = image.copy()
+    image.thumbnail((max_size, max_size))
+    target = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    name, extension = os.path.splitext(filename or 'picture')
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.save(target, format='PNG', optimize=True)
+        extension = '.png'
+    else:
+        image.convert('RGB').save(target, format='JPEG', quality=85, optimize=True)
+        extension = '.jpg'
+    target.seek(0)
+    return target, name + extension
+
+def make_variants(spool, filename):
+    # returns (full, thumbnail); without Pillow, or for files it can't read,
+    # the original is uploaded as is and there is no thumbnail
+    pillow = get_pillow()
+    if pillow is None:
+        return (spool, filename), None
+    Image, ImageOps = pillow
+    try:
+        image = Image.open(spool)
+        # lets the JPEG decoder scale down while decoding instead of after
+        image.draft('RGB', (PICTURE_MAX_SIZE, PICTURE_MAX_SIZE))
+        image = ImageOps.exif_transpose(image)
+        full = _encode(image, PICTURE_MAX_SIZE, filename)
+        thumbnail = _encode(image, THUMBNAIL_SIZE, os.path.splitext(filename or 'picture')[0] + '_thumb')
+    except Exception:
+        spool.seek(0)
+        return (spool, filename), None
+    spool.close()
+    return full, thumbnail
+
+
+class UploadQueue:
+
+    def __init__(self, workers=UPLOAD_WORKERS, queue_size=UPLOAD_QUEUE_SIZE):
+        self.workers = workers
+        # running + waiting jobs; past this uploads are refused instead of piling up
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='upload')
+            return self.executor
+
+    def submit(self, app, user, picture):
+        # the request stream is gone once we return, keep a copy for the worker
+        spool, digest = spool_and_hash(picture.stream)
+
+        asset = self._find_asset(digest)
+        if asset is not None:
+            # same picture as before, nothing to upload
+            spool.close()
+            user.profile_picture = asset.url
+            user.profile_thumbnail = asset.thumbnail_url
+            job = UploadJob(user_id=user.id, status='done', result_url=asset.url)
+            db.session.add(job)
+            db.session.commit()
+            return job
+
+        if not self.slots.acquire(blocking=False):
+            spool.close()
+            raise APIException('Too many uploads in progress, try again later', 503)
+        try:
+            job = UploadJob(user_id=user.id)
+            db.session.add(job)
+            db.session.commit()
+            self._get_executor().submit(self._run, app, job.id, spool, picture.filename, digest)
+        except Exception:
+            spool.close()
+            self.slots.release()
+            raise
+        return job
+
+    def _find_asset(self, digest):
+        # locked until the user points at it and commits, so media cleanup
+        # can't delete the asset in between (see media.cleanup_batch)
+        return MediaAsset.query.filter_by(sha256=digest).with_for_update().first()
+
+    def _store_asset(self, digest, full, thumbnail):
+        asset = MediaAsset(sha256=digest, url=full['secure_url'], public_id=full['public_id'])
+        if thumbnail is not None:
+            asset.thumbnail_url = thumbnail['secure_url']
+            asset.thumbnail_public_id = thumbnail['public_id']
+        db.session.add(asset)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # the same picture finished uploading in another job first, ours
+            # goes to the cleanup outbox (media imports this module)
+            from media import record_orphans
+            db.session.rollback()
+            record_orphans(db.session, [full['secure_url'], thumbnail['secure_url'] if thumbnail is not None else None])
+            db.session.commit()
+            asset = self._find_asset(digest)
+        return asset
+
+    def _run(self, app, job_id, spool, filename, digest):
+        try:
+            with app.app_context():
+                job = UploadJob.query.get(job_id)
+                if job is None:
+                    # the user was deleted while the job was waiting
+                    return
+                try:
+                    job.status = 'running'
+                    db.session.commit()
+                    full, thumbnail = make_variants(spool, filename)
+                    spool = full[0]
+                    uploader = get_uploader()
+                    full_result = uploader.upload(*full)
+                    thumbnail_result = None
+                    if thumbnail is not None:
+                        try:
+                            thumbnail_result = uploader.upload(*thumbnail)
+                        finally:
+                            thumbnail[0].close()
+                    asset = self._store_asset(digest, full_result, thumbnail_result)
+                    user = User.query.get(job.user_id)
+                    if user is not None:
+                        user.profile_picture = asset.url
+                        user.profile_thumbnail = asset.thumbnail_url
+                    job.result_url = asset.url
+                    job.status = 'done'
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    job = UploadJob.query.get(job_id)
+                    if job is not None:
+                        job.status = 'failed'
+                        job.error = str(e)[:200]
+                        db.session.commit()
+                finally:
+                    db.session.remove()
+        finally:
+            spool.close()
+            self.slots.release()
+
+
+upload_queue = UploadQueue()
@@ -1,4 +1,12 @@
-from flask import jsonify, url_for
+import hashlib
+from flask import jsonify, url_for, json, stream_with_context, current_app, request
+from werkzeug.http import is_resource_modified
+
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson'
+}
+STREAM_BATCH_SIZE = 1000
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +23,108 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def get_int_arg(args, name, default=None, minimum=None, maximum=None):
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise APIException("'%s' must be an integer" % name, 400)
+    if minimum is not None and value < minimum:
+        raise APIException("'%s' must be at least %d" % (name, minimum), 400)
+    if maximum is not None and value > maximum:
+        value = maximum
+    return value
+
+def get_fields(args, model):
+    # ?fields=a,b,c -> ('id', 'a', 'b', 'c'), None when every field is wanted
+    value = args.get('fields')
+    if not value:
+        return None
+    fields = ['id']
+    for field in value.split(','):
+        field = field.strip()
+        if not field or field in fields:
+            continue
+        if field not in model.FIELD_COLUMNS:
+            raise APIException("Unknown field '%s'" % field, 400)
+        fields.append(field)
+    return tuple(fields)
+
+def keyset_paginate(query, column, cursor=None, limit=50):
+    # fetch one extra row to know if there is a next page without a count(*)
+    if cursor is not None:
+        query = query.filter(column > cursor)
+    rows = query.order_by(column).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = getattr(rows[-1], column.key)
+    return rows, next_cursor
+
+def stream_query(query, serialize, fmt, batch_size=STREAM_BATCH_SIZE):
+    # rows are fetched from the db in batches of batch_size and written to the
+    # socket as soon as a batch is encoded, so memory does not grow with the table
+    if fmt not in STREAM_FORMATS:
+        raise APIException("stream must be one of: " + ", ".join(STREAM_FORMATS), 400)
+
+    def generate():
+        chunk = []
+        first = True
+        if fmt == 'json':
+            yield '['
+        for row in query.yield_per(batch_size):
+            line = json.dumps(serialize(row))
+            if fmt == 'ndjson':
+                chunk.append(line + '\n')
+            else:
+                chunk.append(line if first else ',' + line)
+            first = False
+            if len(chunk) >= batch_size:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+        if fmt == 'json':
+            yield ']'
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=STREAM_FORMATS[fmt])
+
+def read_records(request):
+    # body as a JSON array, or NDJSON (one object per line) with that content type.
+    # A line that isn't valid JSON is returned as an APIException so it can be
+    # reported with the other per item errors
+    if request.mimetype == 'application/x-ndjson':
+        records = []
+        for number, line in enumerate(request.get_data(as_text=True).splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(APIException("line %d is not valid JSON" % number, 400))
+        return records
+    body = request.get_json(silent=True)
+    if not isinstance(body, list):
+        raise APIException("You need to specify the request body as a json array or ndjson", 400)
+    return body
+
+def make_etag(*parts):
+    return hashlib.sha1('|'.join(str(x) for x in parts).encode('utf-8')).hexdigest()
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+def not_modified(etag, last_modified=None):
+    # returns a 304 when the client copy is current, None when the body has to be sent
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()